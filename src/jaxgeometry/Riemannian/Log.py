@@ -45,3 +45,11 @@ def initialize(M,f=None,method='BFGS'):
         return (res.x,res.fun)
 
     M.Log = shoot
+
+    # batched Logarithms, xs = (coords,charts) and ys stacked along the first axis, by L-BFGS vmapped over the pairs
+    def shoot_batch(xs,ys,v0s=None,maxiter=default_lbfgs_maxiter,tol=default_lbfgs_tol):
+        """ returns (vs, losses, gradient norms, iterations) for the batch """
+        if v0s is None:
+            v0s = jnp.zeros((xs[0].shape[0],M.dim))
+        return jax.vmap(lambda x,y,v0: lbfgs(lambda w: loss(x,w,y),v0,maxiter=maxiter,tol=tol))(xs,ys,v0s)
+    M.Log_batch = jit(shoot_batch,static_argnames=['maxiter'])
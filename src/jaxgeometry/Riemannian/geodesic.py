@@ -20,10 +20,15 @@
 from jaxgeometry.setup import *
 from jaxgeometry.utils import *
 
-def initialize(M):
+def initialize(M,christoffel=True):
+    """ geodesic equation, with christoffel=False the acceleration is computed by M.Gamma_vv without forming Gamma """
+
     def ode_geodesic(c,y):
         t,x,chart = c
-        dx2t = -jnp.einsum('ikl,k,l->i',M.Gamma_g((x[0],chart)),x[1],x[1])
+        if christoffel:
+            dx2t = -jnp.einsum('ikl,k,l->i',M.Gamma_g((x[0],chart)),x[1],x[1])
+        else:
+            dx2t = -M.Gamma_vv((x[0],chart),x[1])
         dx1t = x[1] 
         return jnp.stack((dx1t,dx2t))
 
@@ -45,16 +50,16 @@ def initialize(M):
                                 new_chart,
                                 chart))
     
-    M.geodesic = jit(lambda x,v,dts: integrate(ode_geodesic,chart_update_geodesic,jnp.stack((x[0],v)),x[1],dts))
+    M.geodesic = jit_integrate(lambda x,v,dts,method=default_method,**kwargs: integrate(ode_geodesic,chart_update_geodesic,jnp.stack((x[0],v)),x[1],dts,method=method,**kwargs))
     
-    def Exp(x,v,T=T,n_steps=n_steps):
-        curve = M.geodesic(x,v,dts(T,n_steps))
-        x = curve[1][-1,0]
-        chart = curve[2][-1]
+    def Exp(x,v,T=T,n_steps=n_steps,**kwargs):
+        curve = M.geodesic(x,v,dts(T,n_steps),output='final',**kwargs)
+        x = curve[1][0]
+        chart = curve[2]
         return(x,chart)
     M.Exp = Exp
-    def Expt(x,v,T=T,n_steps=n_steps):
-        curve = M.geodesic(x,v,dts(T,n_steps))
+    def Expt(x,v,T=T,n_steps=n_steps,**kwargs):
+        curve = M.geodesic(x,v,dts(T,n_steps),**kwargs)
         xs = curve[1][:,0]
         charts = curve[2]
         return(xs,charts)
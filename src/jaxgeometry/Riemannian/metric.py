@@ -26,17 +26,53 @@ def initialize(M,truncate_high_order_derivatives=False):
 
     d = M.dim
 
+    # inverse of symmetric positive definite matrix by Cholesky solve
+    cho_inv = lambda A: jax.scipy.linalg.cho_solve((jnp.linalg.cholesky(A),True),jnp.eye(A.shape[0],dtype=A.dtype))
+
     if hasattr(M, 'g'):
+        cometric = False
         if not hasattr(M, 'gsharp'):
-            M.gsharp = lambda x: jnp.linalg.inv(M.g(x))
+            M.gsharp = lambda x: cho_inv(M.g(x))
     elif hasattr(M, 'gsharp'):
+        cometric = True
         if not hasattr(M, 'g'):
-            M.g = lambda x: jnp.linalg.inv(M.gsharp(x))
+            M.g = lambda x: cho_inv(M.gsharp(x))
     else:
         raise ValueError('no metric or cometric defined on manifold')
 
     M.Dg = jacfwdx(M.g) # derivative of metric
 
+    ##### Metric bundle
+    # (g, Cholesky factor of g, gsharp, log|det g|, Gamma) from one linearisation of
+    # the metric (or cometric, if the manifold defines gsharp), inverses by Cholesky solves
+    def metric_bundle(x):
+        n = x[0].shape[0]
+        eye = jnp.eye(n)
+        if not cometric:
+            gx,Dg = jax.linearize(lambda y: M.g((y,x[1])),x[0])
+            Dgx = jax.vmap(Dg,1,2)(eye) # Dgx[k,m,l] = d_l g_km
+            L = jnp.linalg.cholesky(gx)
+            solve = lambda b: jax.scipy.linalg.cho_solve((L,True),b.reshape((n,-1))).reshape(b.shape)
+            gsharpx = solve(eye)
+            logdet = 2.*jnp.sum(jnp.log(jnp.diag(L)))
+            # Christoffel symbols of the first kind, Gamma1[m,k,l] = Gamma_{mkl}
+            Gamma1 = .5*(jnp.einsum('kml->mkl',Dgx)+jnp.einsum('lmk->mkl',Dgx)-jnp.einsum('klm->mkl',Dgx))
+            Gamma = solve(Gamma1)
+        else:
+            # with dg = -g dgsharp g, the products gsharp g are eliminated and the
+            # remaining inverses applied by solves with gsharp
+            gsharpx,Dgsharp = jax.linearize(lambda y: M.gsharp((y,x[1])),x[0])
+            Lsharp = jnp.linalg.cholesky(gsharpx)
+            solve = lambda b: jax.scipy.linalg.cho_solve((Lsharp,True),b.reshape((n,-1))).reshape(b.shape)
+            gx = solve(eye)
+            L = jnp.linalg.cholesky(gx)
+            logdet = -2.*jnp.sum(jnp.log(jnp.diag(Lsharp)))
+            S = solve(jax.vmap(Dgsharp,1,2)(eye)) # S[k,i,l] = (g d_l gsharp)_ki
+            gSg = solve(S.transpose((1,0,2))).transpose((1,0,2)) # gSg[k,l,m] = (g d_m gsharp g)_kl = -d_m g_kl
+            Gamma = .5*(-jnp.einsum('kil->ikl',S)-jnp.einsum('lik->ikl',S)+jnp.einsum('im,klm->ikl',gsharpx,gSg))
+        return (gx,L,gsharpx,logdet,Gamma)
+    M.metric_bundle = metric_bundle
+
     ##### Measure
     M.mu_Q = lambda x: 1./jnp.nlinalg.Det()(M.g(x))
 
@@ -48,30 +84,71 @@ def initialize(M,truncate_high_order_derivatives=False):
     M.det = det
     M.detsharp = detsharp
     def logAbsDet(x,A=None): 
-        return jnp.linalg.slogdet(M.g(x))[1] if A is None else jnp.linalg.slogdet(jnp.tensordot(M.g(x),A,(1,0)))[1]
+        return 2.*jnp.sum(jnp.log(jnp.diag(jnp.linalg.cholesky(M.g(x))))) if A is None else jnp.linalg.slogdet(jnp.tensordot(M.g(x),A,(1,0)))[1]
     def logAbsDetsharp(x,A=None): 
         return jnp.linalg.slogdet(M.gsharp(x))[1] if A is None else jnp.linalg.slogdet(jnp.tensordot(M.gsharp(x),A,(1,0)))[1]
+    # manifolds with structured metrics (e.g. landmarks) may register sharp, flat, orthFrame,
+    # logAbsDetsharp and Gamma_trace applying the metric without dense matrices in the dict
+    # M.metric_overrides, the dense versions below are used otherwise
+    overrides = getattr(M,'metric_overrides',{})
     M.logAbsDet = logAbsDet
-    M.logAbsDetsharp = logAbsDetsharp
+    M.logAbsDetsharp = overrides.get('logAbsDetsharp',logAbsDetsharp)
 
     ##### Sharp and flat map:
-    M.flat = lambda x,v: jnp.tensordot(M.g(x),v,(1,0))
-    M.sharp = lambda x,p: jnp.tensordot(M.gsharp(x),p,(1,0))
+    M.flat = overrides.get('flat',lambda x,v: jnp.tensordot(M.g(x),v,(1,0)))
+    M.sharp = overrides.get('sharp',lambda x,p: jnp.tensordot(M.gsharp(x),p,(1,0)))
 
     ##### Christoffel symbols
     # \Gamma^i_{kl}, indices in that order
     #M.Gamma_g = lambda x: 0.5*(jnp.einsum('im,mkl->ikl',M.gsharp(x),M.Dg(x))
     #               +jnp.einsum('im,mlk->ikl',M.gsharp(x),M.Dg(x))
     #               -jnp.einsum('im,klm->ikl',M.gsharp(x),M.Dg(x)))
-    def Gamma_g(x):
-        Dgx = M.Dg(x)
-        gsharpx = M.gsharp(x)
-        return 0.5*(jnp.einsum('im,kml->ikl',gsharpx,Dgx)
-                   +jnp.einsum('im,lmk->ikl',gsharpx,Dgx)
-                   -jnp.einsum('im,klm->ikl',gsharpx,Dgx))
-    M.Gamma_g = Gamma_g
+    #def Gamma_g(x):
+    #    Dgx = M.Dg(x)
+    #    gsharpx = M.gsharp(x)
+    #    return 0.5*(jnp.einsum('im,kml->ikl',gsharpx,Dgx)
+    #               +jnp.einsum('im,lmk->ikl',gsharpx,Dgx)
+    #               -jnp.einsum('im,klm->ikl',gsharpx,Dgx))
+    M.Gamma_g = lambda x: M.metric_bundle(x)[4]
     M.DGamma_g = jacfwdx(M.Gamma_g)
 
+    # contractions Gamma_vv(x,v)^i = Gamma^i_kl v^k v^l and Gamma_trace(x)^i = gsharp^kl Gamma^i_kl
+    # computed by directional derivatives of the metric (or cometric) without forming Gamma
+    def Gamma_vv(x,v):
+        if not cometric:
+            gv = lambda y: jnp.dot(M.g((y,x[1])),v)
+            gx = M.g(x)
+            a = jax.jvp(gv,(x[0],),(v,))[1] # a_m = d_k g_ml v^k v^l
+            b = .5*jax.grad(lambda y: jnp.dot(v,gv(y)))(x[0]) # b_m = 1/2 d_m g_kl v^k v^l
+            return jax.scipy.linalg.cho_solve((jnp.linalg.cholesky(gx),True),a-b)
+        else:
+            # Gamma(v,v) = -d^2q/dt^2 along the Hamiltonian flow with p = g v
+            gsharpx = M.gsharp(x)
+            p = jax.scipy.linalg.cho_solve((jnp.linalg.cholesky(gsharpx),True),v)
+            Kp = lambda y: jnp.dot(M.gsharp((y,x[1])),p)
+            a = jax.jvp(Kp,(x[0],),(v,))[1]
+            b = .5*jax.grad(lambda y: jnp.dot(p,Kp(y)))(x[0])
+            return -(a-jnp.dot(gsharpx,b))
+    M.Gamma_vv = Gamma_vv
+    def Gamma_trace(x):
+        n = x[0].shape[0]
+        # divergence of the columns of A(y), sum_k d_k A(y)_ik, one column at a time
+        div = lambda A: jnp.sum(jax.lax.map(lambda k: jax.jvp(lambda y: A(y)[:,k],(x[0],),(jnp.eye(n)[k],))[1],jnp.arange(n)),0)
+        if not cometric:
+            gx = M.g(x)
+            L = jnp.linalg.cholesky(gx)
+            gsharpx = jax.scipy.linalg.cho_solve((L,True),jnp.eye(n))
+            a = div(lambda y: jnp.dot(M.g((y,x[1])),gsharpx))
+            b = .5*jax.grad(lambda y: jnp.sum(gsharpx*M.g((y,x[1]))))(x[0])
+            return jax.scipy.linalg.cho_solve((L,True),a-b)
+        else:
+            gsharpx = M.gsharp(x)
+            gx = jax.scipy.linalg.cho_solve((jnp.linalg.cholesky(gsharpx),True),jnp.eye(n))
+            a = div(lambda y: M.gsharp((y,x[1])))
+            b = .5*jax.grad(lambda y: jnp.sum(gx*M.gsharp((y,x[1]))))(x[0])
+            return -(a-jnp.dot(gsharpx,b))
+    M.Gamma_trace = overrides.get('Gamma_trace',Gamma_trace)
+
     # Inner Product from g
     M.dot = lambda x,v,w: jnp.tensordot(jnp.tensordot(M.g(x),w,(1,0)),v,(0,0))
     M.norm = lambda x,v: jnp.sqrt(M.dot(x,v,v))
@@ -81,10 +158,10 @@ def initialize(M,truncate_high_order_derivatives=False):
 
     ##### Gram-Schmidt and basis
     M.gramSchmidt = lambda x,u: (GramSchmidt_f(M.dotf))(x,u)
-    M.orthFrame = lambda x: jnp.linalg.Cholesky(M.gsharp(x))
+    M.orthFrame = overrides.get('orthFrame',lambda x: jnp.linalg.cholesky(M.gsharp(x)))
 
     ##### Hamiltonian
-    M.H = lambda q,p: 0.5*jnp.tensordot(p,jnp.tensordot(M.gsharp(q),p,(1,0)),(0,0))
+    M.H = lambda q,p: 0.5*jnp.dot(p,M.sharp(q,p))
 
     # gradient, divergence, and Laplace-Beltrami
     M.grad = lambda x,f: M.sharp(x,gradx(f)(x))
@@ -51,16 +51,16 @@ def initialize(M):
                             new_chart,
                             chart))
     
-    M.Hamiltonian_dynamics = jit(lambda q,p,dts: integrate(ode_Hamiltonian,chart_update_Hamiltonian,jnp.stack((q[0] if type(q)==type(()) else q,p)),q[1] if type(q)==type(()) else None,dts))
+    M.Hamiltonian_dynamics = jit_integrate(lambda q,p,dts,method=default_method,**kwargs: integrate(ode_Hamiltonian,chart_update_Hamiltonian,jnp.stack((q[0] if type(q)==type(()) else q,p)),q[1] if type(q)==type(()) else None,dts,method=method,**kwargs))
     
-    def Exp_Hamiltonian(q,p,T=T,n_steps=n_steps):
-        curve = M.Hamiltonian_dynamics(q,p,dts(T,n_steps))
-        q = curve[1][-1,0]
-        chart = curve[2][-1]
+    def Exp_Hamiltonian(q,p,T=T,n_steps=n_steps,**kwargs):
+        curve = M.Hamiltonian_dynamics(q,p,dts(T,n_steps),output='final',**kwargs)
+        q = curve[1][0]
+        chart = curve[2]
         return(q,chart)
     M.Exp_Hamiltonian = Exp_Hamiltonian
-    def Exp_Hamiltoniant(q,p,T=T,n_steps=n_steps):
-        curve = M.Hamiltonian_dynamics(q,p,dts(T,n_steps))
+    def Exp_Hamiltoniant(q,p,T=T,n_steps=n_steps,**kwargs):
+        curve = M.Hamiltonian_dynamics(q,p,dts(T,n_steps),**kwargs)
         qs = curve[1][:,0]
         charts = curve[2]
         return(qs,charts)
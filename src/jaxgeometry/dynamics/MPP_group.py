@@ -40,19 +40,26 @@ def initialize(G,Sigma=None,a=None):
         z = jnp.dot(Sigma,G.sharpV(alpha))+at
         dalpha = sign*G.coad(z,alpha) # =-jnp.einsum('k,i,ijk->j',alpha,z,G.C) 
         return dalpha
-    G.mpp = lambda alpha,dts,sigma=jnp.eye(G.dim): integrate(partial(ode_mpp,sigma),None,alpha,None,dts)
+    G.mpp = lambda alpha,dts,sigma=jnp.eye(G.dim),**kwargs: integrate(partial(ode_mpp,sigma),None,alpha,None,dts,**kwargs)
 
     # reconstruction
-    def ode_mpprec(sigma,c,y):
+    def xi_mpprec(sigma,c,y):
         t,g,_ = c
         
         alpha, = y
         at = a(t) if a is not None else jnp.zeros_like(alpha)
         
         z = jnp.dot(Sigma,G.sharpV(alpha))+at
-        dgt = G.invpf(g,G.VtoLA(z))
+        return G.VtoLA(z)
+    def ode_mpprec(sigma,c,y):
+        t,g,_ = c
+        dgt = G.invpf(g,xi_mpprec(sigma,c,y))
         return dgt
-    G.mpprec = lambda g,alpha,dts,sigma=jnp.eye(G.dim): integrate(partial(ode_mpprec,sigma),None,g,None,dts,alpha)
+    def mpprec(g,alpha,dts,sigma=jnp.eye(G.dim),method=default_method,**kwargs):
+        if method in group_tableaux: # Lie group integrator
+            return integrate_group(partial(xi_mpprec,sigma),G,g,dts,alpha,method=method)
+        return integrate(partial(ode_mpprec,sigma),None,g,None,dts,alpha,method=method,**kwargs)
+    G.mpprec = mpprec
 
     # tracking point (not reduced to Lie algebra) to allow point-depending drift
     def ode_mpp_drift(sigma,c,y):
@@ -68,10 +75,11 @@ def initialize(G,Sigma=None,a=None):
         return jnp.hstack((dalpha,dgt.flatten()))
     G.mpp_drift = lambda alpha,g,dts,sigma=jnp.eye(G.dim): integrate(partial(ode_mpp_drift,sigma),None,jnp.hstack((alpha,g.flatten())),None,dts)
 
-    def MPP_forwardt(g,alpha,sigma,T=T,n_steps=n_steps):
+    def MPP_forwardt(g,alpha,sigma,T=T,n_steps=n_steps,rec_method=None,**kwargs):
+        """ rec_method optionally sets a separate (e.g. Lie group) method for the reconstruction """
         _dts = dts(T=T,n_steps=n_steps)
-        (ts,alphas) = G.mpp(alpha,_dts,sigma)
-        (ts,gs) = G.mpprec(g,alphas,_dts,sigma)
+        (ts,alphas) = G.mpp(alpha,_dts,sigma,**kwargs)
+        (ts,gs) = G.mpprec(g,alphas,_dts,sigma,**(kwargs if rec_method is None else dict(kwargs,method=rec_method)))
         
         return(gs,alphas)
     G.MPP_forwardt = MPP_forwardt
@@ -44,3 +44,11 @@ def initialize(M):
         return (res.x,res.fun)
 
     M.Log_MPP_landmarks = shoot
+
+    # batched version, xs = (coords,charts), ys, qpss and lambd0s stacked along the first axis
+    def shoot_batch(xs,ys,qpss,_dts,lambd0s=None,maxiter=default_lbfgs_maxiter,tol=default_lbfgs_tol):
+        """ returns (lambds, losses, gradient norms, iterations) for the batch """
+        if lambd0s is None:
+            lambd0s = jnp.zeros((xs[0].shape[0],M.dim))
+        return jax.vmap(lambda x,y,qps,lambd0: lbfgs(lambda w: loss(x,w,y,qps,_dts),lambd0,maxiter=maxiter,tol=tol))(xs,ys,qpss,lambd0s)
+    M.Log_MPP_landmarks_batch = jit(shoot_batch,static_argnames=['maxiter'])
@@ -45,6 +45,6 @@ def initialize(M):
                                     chart),
                     )
         
-        flow = jit(lambda x,dts: integrate(ode_flow,chart_update_flow,x[0],x[1],dts))
+        flow = jit_integrate(lambda x,dts,method=default_method,**kwargs: integrate(ode_flow,chart_update_flow,x[0],x[1],dts,method=method,**kwargs))
         return flow
     M.flow = flow
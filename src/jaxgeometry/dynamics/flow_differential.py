@@ -35,8 +35,7 @@ def initialize(M):
         q = qp[0].reshape((M.N,M.m))  # points
         p = qp[1].reshape((M.N,M.m))  # points
 
-        dk = M.dk_q(q,q)
-        ddphi = jnp.einsum('iab,jic,jb->iac',dphi,dk,p)
+        ddphi = jnp.einsum('iab,ibc->iac',dphi,M.dK_matvec(q,q,p))
 
         return ddphi 
 
@@ -51,3 +50,26 @@ def initialize(M):
         (ts,dphis,charts) = integrate(ode_differential,chart_update_differential,jnp.tile(jnp.eye(M.m),(M.N,1,1)),None,dts,qps)
         return (ts,dphis,charts)
     M.flow_differential = flow_differential
+
+    # deformation of points by the flow of the velocity field K(.,q)p along phase-space path qps
+    def ode_points(c,y):
+        t,x,chart = c
+        qp, = y
+        return M.K_matvec(x,qp[0],qp[1])
+    flow_points = lambda x,qps,dts: integrate(ode_points,None,x,None,dts,qps,output='final')[1]
+
+    def deformation(x,qps,dts,batch_size=1024):
+        """ returns (phi(x),Dphi(x)) for points x of shape (n,m), flowed in batches of batch_size 
+        points with the Jacobians by forward mode differentiation of the flow """
+        x = x.reshape((-1,M.m))
+        n = x.shape[0]
+        batches = -(-n//batch_size)
+        xs = jnp.pad(x,((0,batches*batch_size-n),(0,0)),mode='edge').reshape((batches,-1))
+        tangents = jnp.tile(jnp.eye(M.m),(1,batch_size)) # row c moves all points along e_c
+        def batch(x):
+            (phi,dphi) = jax.linearize(lambda x: flow_points(x,qps,dts),x)
+            return (phi,jax.vmap(dphi)(tangents))
+        (phis,dphis) = lax.map(batch,xs)
+        Dphis = dphis.reshape((batches,M.m,batch_size,M.m)).transpose((0,2,3,1)).reshape((-1,M.m,M.m))
+        return (phis.reshape((-1,M.m))[:n],Dphis[:n])
+    M.deformation = jit(deformation,static_argnames=['batch_size'])
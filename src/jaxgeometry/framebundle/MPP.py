@@ -27,7 +27,7 @@ from jax.example_libraries import optimizers
 # notation mostly follows Anisotropic covariance on manifolds and most probable paths,
 # Erlend Grong and Stefan Sommer, 2021
 
-def initialize(M):
+def initialize(M,gradient=default_gradient):
 
     def ode_mpp(c,y):
         t,gammafvchi,chart = c
@@ -78,11 +78,11 @@ def initialize(M):
                                 chart))
     
     
-    M.mpp = jit(lambda gammafvchi,lamb,dts: integrate(ode_mpp,chart_update_mpp,gammafvchi[0],gammafvchi[1],dts,lamb))
+    M.mpp = jit_integrate(lambda gammafvchi,lamb,dts,**kwargs: integrate(ode_mpp,chart_update_mpp,gammafvchi[0],gammafvchi[1],dts,lamb,**kwargs))
     
     @jit
     def MPP_forwardt(u,lamb,v,chi,T=T,n_steps=n_steps):
-        curve = M.mpp((jnp.hstack((u[0],v,chi)),u[1]),jnp.broadcast_to(lamb[None,...],(n_steps,)+lamb.shape),dts(T,n_steps))
+        curve = M.mpp((jnp.hstack((u[0],v,chi)),u[1]),jnp.broadcast_to(lamb[None,...],(n_steps,)+lamb.shape),dts(T,n_steps),gradient=gradient)
         us = curve[1][:,0:M.dim+M.dim**2]
         vs = curve[1][:,M.dim+M.dim**2:2*M.dim+M.dim**2]
         chis = curve[1][:,2*M.dim+M.dim**2:]
@@ -27,19 +27,26 @@ def initialize(G):
 
     def ode_EP(c,y):
         t,mu,_ = c
-        xi = G.invFl(mu)
-        dmut = -G.coad(xi,mu)
+        dmut = -G.coadsharpV(mu)
         return dmut
-    G.EP = lambda mu,_dts=None: integrate(ode_EP,None,mu,None,dts() if _dts is None else _dts)
+    G.EP = lambda mu,_dts=None,**kwargs: integrate(ode_EP,None,mu,None,dts() if _dts is None else _dts,**kwargs)
 
     # reconstruction
-    def ode_EPrec(c,y):
+    def xi_EPrec(c,y):
         t,g,_ = c
         mu, = y
         xi = G.invFl(mu)
-        dgt = G.dL(g,G.e,G.VtoLA(xi))
+        return G.VtoLA(xi)
+    def ode_EPrec(c,y):
+        t,g,_ = c
+        dgt = G.dL(g,G.e,xi_EPrec(c,y))
         return dgt
-    G.EPrec = lambda g,mus,_dts=None: integrate(ode_EPrec,None,g,None,dts() if _dts is None else _dts,mus)
+    def EPrec(g,mus,_dts=None,method=default_method):
+        _dts = dts() if _dts is None else _dts
+        if method in group_tableaux: # Lie group integrator
+            return integrate_group(xi_EPrec,G,g,_dts,mus,method=method)
+        return integrate(ode_EPrec,None,g,None,_dts,mus,method=method)
+    G.EPrec = EPrec
 
     ### geodesics
     G.coExpEP = lambda g,mu: G.EPrec(g,G.EP(mu)[1])[1][-1]
@@ -27,17 +27,25 @@ def initialize(G):
 
     def ode_LP(c,y):
         t,mu,_ = c
-        dmut = G.coad(G.dHminusdmu(mu),mu)
+        dmut = G.coadsharpV(mu)
         return dmut
-    G.LP = lambda mu,_dts=None: integrate(ode_LP,None,mu,None,dts() if _dts is None else _dts)
+    G.LP = lambda mu,_dts=None,**kwargs: integrate(ode_LP,None,mu,None,dts() if _dts is None else _dts,**kwargs)
 
     # reconstruction
-    def ode_LPrec(c,y):
+    def xi_LPrec(c,y):
         t,g,_ = c
         mu, = y
-        dgt = G.dL(g,G.e,G.VtoLA(G.dHminusdmu(mu)))
+        return G.VtoLA(G.dHminusdmu(mu))
+    def ode_LPrec(c,y):
+        t,g,_ = c
+        dgt = G.dL(g,G.e,xi_LPrec(c,y))
         return dgt
-    G.LPrec = lambda g,mus,_dts=None: integrate(ode_LPrec,None,g,None,dts() if _dts is None else _dts,mus)
+    def LPrec(g,mus,_dts=None,method=default_method):
+        _dts = dts() if _dts is None else _dts
+        if method in group_tableaux: # Lie group integrator
+            return integrate_group(xi_LPrec,G,g,_dts,mus,method=method)
+        return integrate(ode_LPrec,None,g,None,_dts,mus,method=method)
+    G.LPrec = LPrec
 
     ### geodesics
     G.coExpLP = lambda g,mu: G.LPrec(g,G.LP(mu)[1])[1][-1]
@@ -32,12 +32,12 @@ def initialize(G):
         return .5*G.gpsi(q,v,v)
     G.Lagrangianpsi = Lagrangianpsi
     G.dLagrangianpsidq = jax.grad(G.Lagrangianpsi)
-    G.dLagrangianpsidv = jax.grad(G.Lagrangianpsi)
+    G.dLagrangianpsidv = jax.grad(G.Lagrangianpsi,argnums=1)
     # LA restricted Lagrangian
     def l(hatxi):
         return 0.5*G.gV(hatxi,hatxi)
     G.l = l
-    G.dldhatxi = jax.grad(G.l)
+    G.dldhatxi = lambda hatxi: G.flatV(hatxi) # l is quadratic, dl/dhatxi = A hatxi
 
     # Hamiltonian using psi map
     def Hpsi(q,p):
@@ -47,20 +47,20 @@ def initialize(G):
     def Hminus(mu):
         return .5*G.cogV(mu,mu)
     G.Hminus = Hminus
-    G.dHminusdmu = jax.grad(G.Hminus)
+    G.dHminusdmu = lambda mu: G.sharpV(mu) # dHminus/dmu = W mu
 
     # Legendre transformation. The above Lagrangian is hyperregular
     G.FLpsi = lambda q,v: (q,G.dLagrangianpsidv(q,v))
     G.invFLpsi = lambda q,p: (q,G.cogpsi(q,p))
     def HL(q,p):
-        (q,v) = invFLpsi(q,p)
-        return jnp.dot(p,v)-L(q,v)
+        (q,v) = G.invFLpsi(q,p)
+        return jnp.dot(p,v)-G.Lagrangianpsi(q,v)
     G.HL = HL
     G.Fl = lambda hatxi: G.dldhatxi(hatxi)
-    G.invFl = lambda mu: G.cogV(mu)
+    G.invFl = lambda mu: G.sharpV(mu)
     def hl(mu):
-        hatxi = invFl(mu)
-        return jnp.dot(mu,hatxi)-l(hatxi)
+        hatxi = G.invFl(mu)
+        return jnp.dot(mu,hatxi)-G.l(hatxi)
     G.hl = hl
 
     # default Hamiltonian
@@ -20,91 +20,141 @@
 from jaxgeometry.setup import *
 from jaxgeometry.utils import *
 
+# invariant metric from square root cometric sigma, metric A = sigma^-T sigma^-1 and
+# cometric W = sigma sigma^T, their Cholesky factors and W contracted with the structure
+# constants, computed once per sigma. A pytree, so it can be passed to jitted functions
+# with sigma as data
+@jax.tree_util.register_pytree_node_class
+class InvariantMetric(object):
+    """ invariant metric with square root cometric sigma """
+
+    def __init__(self,sigma,C):
+        self.sigma = sigma
+        self.sqrtA = jnp.linalg.inv(sigma) # square root metric
+        self.A = jnp.tensordot(self.sqrtA,self.sqrtA,(0,0)) # metric
+        self.W = jnp.tensordot(sigma,sigma,(1,1)) # covariance (cometric)
+        self.cholA = jnp.linalg.cholesky(self.A)
+        self.cholW = jnp.linalg.cholesky(self.W)
+        self.coadW = jnp.tensordot(self.W,C,(0,0)) # coadW_ljk = W_il C_ijk, coad(W mu,nu)_j = coadW_ljk mu_l nu_k
+
+    def __str__(self):
+        return "invariant metric with sigma %s" % (self.sigma,)
+
+    def tree_flatten(self):
+        return ((self.sigma,self.sqrtA,self.A,self.W,self.cholA,self.cholW,self.coadW),None)
+
+    @classmethod
+    def tree_unflatten(cls,aux_data,children):
+        metric = object.__new__(cls)
+        (metric.sigma,metric.sqrtA,metric.A,metric.W,metric.cholA,metric.cholW,metric.coadW) = children
+        return metric
+
 def initialize(G,_sigma=None):
     """ add left-/right-invariant metric related structures to group 
 
-    parameter sigma is square root cometric / diffusion field
+    parameter sigma is square root cometric / diffusion field. The sigma arguments below
+    take either a matrix or an InvariantMetric from G.invariant_metric(sigma),
+    the latter avoids recomputing the metric. The default metric is G.invmetric
     """
 
     if _sigma is None:
         _sigma = jnp.eye(G.dim)
 
-    G.sqrtA = lambda sigma=_sigma: G.inv(sigma) # square root metric
-    G.A = lambda sigma=_sigma: jnp.tensordot(G.sqrtA(sigma),G.sqrtA(sigma),(0,0)) # metric
-    G.W = lambda sigma=_sigma: jnp.tensordot(sigma,sigma,(1,1)) # covariance (cometric)
-    def gV(v=None,w=None,sigma=_sigma):
+    G.invariant_metric = lambda sigma: InvariantMetric(sigma,G.C)
+    G.invmetric = G.invariant_metric(_sigma)
+    def metric(sigma):
+        if sigma is None:
+            return G.invmetric
+        return sigma if isinstance(sigma,InvariantMetric) else G.invariant_metric(sigma)
+
+    G.sqrtA = lambda sigma=None: metric(sigma).sqrtA # square root metric
+    G.A = lambda sigma=None: metric(sigma).A # metric
+    G.W = lambda sigma=None: metric(sigma).W # covariance (cometric)
+    G.logAbsDetV = lambda sigma=None: 2.*jnp.sum(jnp.log(jnp.diag(metric(sigma).cholA)))
+    def gV(v=None,w=None,sigma=None):
+        A = G.A(sigma)
         if v is None and w is None:
-            return G.A(sigma)
+            return A
         elif v is not None and w is None:
-            return jnp.tensordot(G.A(sigma),v,(1,0))
+            return jnp.tensordot(A,v,(1,0))
         elif v.ndim == 1 and w.ndim == 1:
-            return jnp.dot(v,jnp.dot(G.A(sigma),w))
-        elif v.ndim == 1 and not w:
-            return jnp.dot(G.A(sigma),v)
+            return jnp.dot(v,jnp.dot(A,w))
         elif v.ndim == 2 and w.ndim == 2:
-            return jnp.tensordot(v,jnp.tensordot(G.A(sigma),w,(1,0)),(0,0))
+            return jnp.tensordot(v,jnp.tensordot(A,w,(1,0)),(0,0))
         else:
             assert(False)
     G.gV = gV
-    def cogV(cov=None,cow=None,sigma=_sigma):
+    def cogV(cov=None,cow=None,sigma=None):
+        W = G.W(sigma)
         if cov is None and cow is None:
-            return G.W(sigma)
+            return W
         elif cov is not None and cow is None:
-            return jnp.tensordot(G.W(sigma),cov,(1,0))
+            return jnp.tensordot(W,cov,(1,0))
         elif cov.ndim == 1 and cow.ndim == 1:
-            return jnp.dot(cov,jnp.dot(G.W(sigma),cow))
+            return jnp.dot(cov,jnp.dot(W,cow))
         elif cov.ndim == 2 and cow.ndim == 2:
-            return jnp.tensordot(cov,jnp.tensordot(G.W(sigma),cow,(1,0)),(0,0))
+            return jnp.tensordot(cov,jnp.tensordot(W,cow,(1,0)),(0,0))
         else:
             assert(False)
     G.cogV = cogV
-    def gLA(xiv,xiw,sigma=_sigma):
+    def gLA(xiv,xiw,sigma=None):
         v = G.LAtoV(xiv)
         w = G.LAtoV(xiw)
         return G.gV(v,w,sigma)
     G.gLA = gLA
-    def cogLA(coxiv,coxiw,sigma=_sigma):
+    def cogLA(coxiv,coxiw,sigma=None):
         cov = G.LAtoV(coxiv)
         cow = G.LAtoV(coxiw)
         return G.cogV(cov,cow,sigma)
     G.cogLA = cogLA
-    def gG(g,vg,wg,sigma=_sigma):
+    def gG(g,vg,wg,sigma=None):
         xiv = G.invpb(g,vg)
         xiw = G.invpb(g,wg)
         return G.gLA(xiv,xiw,sigma)
     G.gG = gG
-    def gpsi(hatxi,v=None,w=None,sigma=_sigma):
-        g = G.psi(hatxi)
-        vg = G.dpsi(hatxi,v)
-        wg = G.dpsi(hatxi,w)
-        return G.gG(g,vg,wg,sigma)
+    # metric in psi coordinates, gpsi = J^T A J with J the pullback of dpsi to V, and its
+    # inverse cogpsi = J^-1 W J^-T by solves with J
+    psiframe = lambda hatxi: G.LAtoV(G.invpb(G.psi(hatxi),G.dpsi(hatxi)))
+    def gpsi(hatxi,v=None,w=None,sigma=None):
+        J = psiframe(hatxi)
+        gJ = jnp.dot(J.T,jnp.dot(G.A(sigma),J))
+        if v is not None and w is not None:
+            return jnp.dot(v,jnp.dot(gJ,w))
+        elif v is not None:
+            return jnp.dot(gJ,v)
+        return gJ
     G.gpsi = gpsi
-    def cogpsi(hatxi,p=None,pp=None,sigma=_sigma):
-        invgpsi = G.inv(G.gpsi(hatxi,sigma=sigma))
+    def cogpsi(hatxi,p=None,pp=None,sigma=None):
+        J = psiframe(hatxi)
+        cogJ = lambda p: jnp.linalg.solve(J,jnp.dot(G.W(sigma),jnp.linalg.solve(J.T,p)))
         if p is not None and pp is not None:
-            return jnp.tensordot(p,jnp.tensordot(invgpsi,pp,(1,0)),(0,0))
-        elif p and not pp:
-            return jnp.tensordot(invgpsi,p,(1,0))
-        return invgpsi
+            return jnp.dot(p,cogJ(pp))
+        elif p is not None:
+            return cogJ(p)
+        return cogJ(jnp.eye(G.dim))
     G.cogpsi = cogpsi
 
     # sharp/flat mappings
-    def sharpV(mu,sigma=_sigma):
+    def sharpV(mu,sigma=None):
         return jnp.dot(G.W(sigma),mu)
     G.sharpV = sharpV
-    def flatV(v,sigma=_sigma):
+    def flatV(v,sigma=None):
         return jnp.dot(G.A(sigma),v)
     G.flatV = flatV
-    def sharp(g,pg,sigma=_sigma):
+    def sharp(g,pg,sigma=None):
         return G.invpf(g,G.VtoLA(jnp.dot(G.W(sigma),G.LAtoV(G.invcopb(g,pg)))))
     G.sharp = sharp
-    def flat(g,vg,sigma=_sigma):
+    def flat(g,vg,sigma=None):
         return G.invcopf(g,G.VtoLA(jnp.dot(G.A(sigma),G.LAtoV(G.invpb(g,vg)))))
     G.flat = flat
-    def sharppsi(hatxi,p,sigma=_sigma):
-        return jnp.tensordot(G.cogpsi(hatxi,sigma=sigma),p,(1,0))
+    def sharppsi(hatxi,p,sigma=None):
+        return G.cogpsi(hatxi,p,sigma=sigma)
     G.sharppsi = sharppsi
-    def flatpsi(hatxi,v,sigma=_sigma):
-        return jnp.tensordot(G.gpsi(hatxi,sigma=sigma),v,(1,0))
+    def flatpsi(hatxi,v,sigma=None):
+        return G.gpsi(hatxi,v,sigma=sigma)
     G.flatpsi = flatpsi
 
+    # coadjoint action of the sharp of mu on mu, coad(sharpV(mu),mu)
+    def coadsharpV(mu,sigma=None):
+        return jnp.tensordot(jnp.tensordot(metric(sigma).coadW,mu,(0,0)),mu,(1,0))
+    G.coadsharpV = coadsharpV
@@ -24,9 +24,9 @@ from jaxgeometry.utils import *
 def horz_vert_split(x,proj,sigma,G,M):
     # compute kernel of proj derivative with respect to inv A metric
     rank = M.dim
-    Xframe = jnp.tensordot(G.invpf(x,G.eiLA),sigma,(2,0))
+    Xframe = jnp.tensordot(G.invpf(x,G.eiLA),sigma,(x.ndim,0))
     Xframe_inv = jnp.linalg.pinv(Xframe.reshape((-1,G.dim)))
-    dproj = jnp.einsum('...ij,ijk->...k',jacrev(proj)(x), Xframe)
+    dproj = jnp.tensordot(jacrev(proj)(x),Xframe,x.ndim)
     (_,_,Vh) = jnp.linalg.svd(jax.lax.stop_gradient(dproj),full_matrices=True)
     ns = Vh[rank:].T # null space
     proj_ns = jnp.tensordot(ns,ns,(1,1))    
@@ -44,9 +44,9 @@ def get_sde_fiber(sde_f,proj,G,M):
         
         (Xframe,Xframe_inv,_,proj_ns,_) = horz_vert_split(g,proj,sigma,G,M)
         
-        det = jnp.tensordot(Xframe,jnp.tensordot(proj_ns,jnp.tensordot(Xframe_inv,det.flatten(),(1,0)),(1,0)),(2,0)).reshape(g.shape)
-        sto = jnp.tensordot(Xframe,jnp.tensordot(proj_ns,jnp.tensordot(Xframe_inv,sto.flatten(),(1,0)),(1,0)),(2,0)).reshape(g.shape)
-        X = jnp.tensordot(Xframe,jnp.tensordot(proj_ns,jnp.tensordot(Xframe_inv,X.reshape((-1,G.dim)),(1,0)),(1,0)),(2,0)).reshape(X.shape)
+        det = jnp.tensordot(Xframe,jnp.tensordot(proj_ns,jnp.tensordot(Xframe_inv,det.flatten(),(1,0)),(1,0)),(g.ndim,0)).reshape(g.shape)
+        sto = jnp.tensordot(Xframe,jnp.tensordot(proj_ns,jnp.tensordot(Xframe_inv,sto.flatten(),(1,0)),(1,0)),(g.ndim,0)).reshape(g.shape)
+        X = jnp.tensordot(Xframe,jnp.tensordot(proj_ns,jnp.tensordot(Xframe_inv,X.reshape((-1,G.dim)),(1,0)),(1,0)),(g.ndim,0)).reshape(X.shape)
         
         return (det,sto,X,*dys_sde)
 
@@ -59,9 +59,9 @@ def get_sde_horz(sde_f,proj,G,M):
         dt,dW = y
         
         (Xframe,Xframe_inv,proj_horz,_,_) = horz_vert_split(g,proj,sigma,G,M)        
-        det = jnp.tensordot(Xframe,jnp.tensordot(proj_horz,jnp.tensordot(Xframe_inv,det.flatten(),(1,0)),(1,0)),(2,0)).reshape(g.shape)
-        sto = jnp.tensordot(Xframe,jnp.tensordot(proj_horz,jnp.tensordot(Xframe_inv,sto.flatten(),(1,0)),(1,0)),(2,0)).reshape(g.shape)
-        X = jnp.tensordot(Xframe,jnp.tensordot(proj_horz,jnp.tensordot(Xframe_inv,X.reshape((-1,G.dim)),(1,0)),(1,0)),(2,0)).reshape(X.shape)
+        det = jnp.tensordot(Xframe,jnp.tensordot(proj_horz,jnp.tensordot(Xframe_inv,det.flatten(),(1,0)),(1,0)),(g.ndim,0)).reshape(g.shape)
+        sto = jnp.tensordot(Xframe,jnp.tensordot(proj_horz,jnp.tensordot(Xframe_inv,sto.flatten(),(1,0)),(1,0)),(g.ndim,0)).reshape(g.shape)
+        X = jnp.tensordot(Xframe,jnp.tensordot(proj_horz,jnp.tensordot(Xframe_inv,X.reshape((-1,G.dim)),(1,0)),(1,0)),(g.ndim,0)).reshape(X.shape)
         
         return (det,sto,X,*dys_sde)
 
@@ -77,9 +77,9 @@ def get_sde_lifted(sde_f,proj,G,M):
         (Xframe,Xframe_inv,proj_horz,_,horz) = horz_vert_split(g,proj,sigma,G,M) 
 
         
-        det = jnp.tensordot(Xframe,jnp.tensordot(horz,det,(1,0)),(2,0)).reshape(g.shape)
-        sto = jnp.tensordot(Xframe,jnp.tensordot(horz,sto,(1,0)),(2,0)).reshape(g.shape)
-        X = jnp.tensordot(Xframe,jnp.tensordot(horz,X,(1,0)),(2,0)).reshape((G.dim,G.dim,M.dim))
+        det = jnp.tensordot(Xframe,jnp.tensordot(horz,det,(1,0)),(g.ndim,0)).reshape(g.shape)
+        sto = jnp.tensordot(Xframe,jnp.tensordot(horz,sto,(1,0)),(g.ndim,0)).reshape(g.shape)
+        X = jnp.tensordot(Xframe,jnp.tensordot(horz,X,(1,0)),(g.ndim,0)).reshape(g.shape+(M.dim,))
         
         return (det,sto,X,jnp.zeros_like(sigma),*dys_sde)
 
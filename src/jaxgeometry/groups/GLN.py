@@ -54,14 +54,8 @@ class GLN(LieGroup):
                 assert(False)
         self.LAtoV = LAtoV
 
+        # scaling and squaring Pade exponential and inverse scaling and squaring logarithm
         self.Expm = jax.scipy.linalg.expm
-        def logm(b):
-            I = jnp.eye(b.shape[0])
-            res = jnp.zeros_like(b)
-            ITERATIONS = 20
-            for k in range(1, ITERATIONS):
-                res += pow(-1, k+1) * jnp.linalg.matrix_power(b-I, k)/k
-            return res
         self.Logm = logm
 
         super(GLN,self).initialize()
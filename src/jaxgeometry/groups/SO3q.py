@@ -0,0 +1,110 @@
+## This file is part of Jax Geometry
+#
+# Copyright (C) 2021, Stefan Sommer (sommer@di.ku.dk)
+# https://bitbucket.org/stefansommer/jaxgeometry
+#
+# Jax Geometry is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Jax Geometry is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Jax Geometry. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from jaxgeometry.setup import *
+from jaxgeometry.params import *
+
+from jaxgeometry.groups.group import *
+from jaxgeometry.groups.SON import SON
+
+import matplotlib.pyplot as plt
+
+class SO3q(LieGroup):
+    """ Special Orthogonal Group SO(3) represented by unit quaternions (w,x,y,z) 
+
+    Elements, tangent vectors and Lie algebra elements are quaternions. The Lie algebra element of
+    the rotation vector omega is the pure quaternion (0,omega/2), and coordinates in V are those of
+    SON(3), so structure constants, metrics and coordinate expressions agree with SON(3).
+    Use to_matrix and from_matrix to convert to and from SON(3).
+    """
+
+    def __init__(self,invariance='left'):
+        LieGroup.__init__(self,3,3,invariance=invariance)
+
+        self.emb_dim = 4
+        self.e = jnp.array([1.,0.,0.,0.]) # identity element
+        self.zeroLA = jnp.zeros(4) # zero element in LA
+        self.signature = '(q)'
+
+        self.injectivity_radius = 2*jnp.pi
+
+        # project to group
+        self.to_group = lambda g: g/jnp.linalg.norm(g,axis=-1,keepdims=True)
+        self.to_matrix = qtomatrix
+        self.from_matrix = matrixtoq
+
+        ## coordinate chart linking LA and V, with SON(3) coordinates hatxi = (-omega_3,omega_2,-omega_1)
+        def VtoLA(hatxi):
+            return .5*jnp.stack((jnp.zeros_like(hatxi[0]),-hatxi[2],hatxi[1],-hatxi[0]))
+        self.VtoLA = VtoLA
+        self.LAtoV = lambda xi: 2.*jnp.stack((-xi[3],xi[2],-xi[1]))
+
+        ## group operations on quaternions, further axes broadcast
+        self.inv = qconj
+        self.L = lambda g,h: qmul(g,h)
+        self.R = lambda g,h: qmul(h,g)
+        self.dL = lambda g,h,vh=None: qmul(g,vh) if vh is not None else jax.jacfwd(lambda h: qmul(g,h))(h)
+        self.dR = lambda g,h,vh=None: qmul(vh,g) if vh is not None else jax.jacfwd(lambda h: qmul(h,g))(h)
+        # cotangent lifts, left/right multiplication by qconj(g) is the transpose of multiplication by g
+        self.codL = lambda g,h,ph: qmul(qconj(self.inv(g)),ph)
+        self.codR = lambda g,h,ph: qmul(ph,qconj(self.inv(g)))
+        self.bracket = lambda xi,eta: qmul(xi,eta)-qmul(eta,xi)
+        eiLA = self.VtoLA(jnp.eye(self.dim))
+        self.C = self.LAtoV(self.bracket(eiLA[:,:,np.newaxis],eiLA[:,np.newaxis,:])).transpose((1,2,0)) # structure constants
+
+        ## exponential and logarithm, the series close to 0 keeps all derivatives finite at the identity
+        def Expm(xi):
+            theta2 = jnp.sum(jnp.square(xi[1:]))
+            small = theta2 < 1e-3
+            theta = jnp.sqrt(jnp.where(small,1.,theta2))
+            cos = jnp.where(small,1.-theta2/2.+theta2**2/24.,jnp.cos(theta))
+            sinc = jnp.where(small,1.-theta2/6.+theta2**2/120.,jnp.sin(theta)/theta)
+            return jnp.concatenate((cos[np.newaxis],sinc*xi[1:]))
+        self.Expm = Expm
+        def Logm(g):
+            g = jnp.where(g[0] < 0,-g,g) # principal logarithm, rotation angle at most pi
+            s2 = jnp.sum(jnp.square(g[1:]))
+            small = s2 < 1e-6
+            s = jnp.sqrt(jnp.where(small,1.,s2))
+            coef = jnp.where(small,1.+s2/6.,jnp.arctan2(s,g[0])/s)
+            return jnp.concatenate((jnp.zeros(1),coef*g[1:]))
+        self.Logm = Logm
+
+        super(SO3q,self).initialize()
+
+    def __str__(self):
+        return "SO(3) as unit quaternions (dimension %d)" % (self.dim)
+
+    def newfig(self):
+        newfig3d()
+
+    ### plotting, via rotation matrices
+    def plot_path(self,g,color_intensity=1.,color=None,linewidth=3.,alpha=1.,prevg=None):
+        assert(len(g.shape)>1)
+        for i in range(g.shape[0]):
+            self.plotg(g[i],
+                  linewidth=linewidth if i==0 or i==g.shape[0]-1 else .3,
+                  color_intensity=color_intensity if i==0 or i==g.shape[0]-1 else .7,
+                  alpha=alpha,
+                  prevg=g[i-1] if i>0 else None)
+        return 
+
+    def plotg(self,g,color_intensity=1.,color=None,linewidth=3.,alpha=1.,prevg=None):
+        return SON.plotg(self,self.to_matrix(g),color_intensity=color_intensity,color=color,linewidth=linewidth,alpha=alpha,
+                         prevg=self.to_matrix(prevg) if prevg is not None else None)
@@ -40,9 +40,9 @@ class SON(LieGroup):
 
         ## coordinate chart linking Lie algebra LA={A\in\RR^{NxN}|\trace{A}=0} and V=\RR^G_dim
         # derived from https://stackoverflow.com/questions/25326462/initializing-a-symmetric-theano-dmatrix-from-its-upper-triangle
-        r = jnp.arange(N)
-        tmp_mat = r[jnp.newaxis, :] + ((N * (N - 3)) // 2-(r * (r - 1)) // 2)[::-1,jnp.newaxis]
-        triu_index_matrix = jnp.triu(tmp_mat+1)-jnp.diag(jnp.diagonal(tmp_mat+1))
+        r = np.arange(N)
+        tmp_mat = r[np.newaxis, :] + ((N * (N - 3)) // 2-(r * (r - 1)) // 2)[::-1,np.newaxis]
+        triu_index_matrix = np.triu(tmp_mat+1)-np.diag(np.diagonal(tmp_mat+1))
 
         def VtoLA(hatxi): # from \RR^G_dim to LA
             if hatxi.ndim == 1:
@@ -54,22 +54,51 @@ class SON(LieGroup):
         self.VtoLA = VtoLA
         self.LAtoV = lambda m: m[np.triu_indices(N, 1)]
 
-        #import theano.tensor.slinalg
-        #Expm = jnp.slinalg.Expm()
-        def Expm(g): # hardcoded for skew symmetric matrices to allow higher-order gradients
-            (w,V) = jnp.linalg.eigh(1.j*g)
-            w = -1j*w
-            expm = jnp.real(jnp.tensordot(V,jnp.tensordot(jnp.diag(jnp.exp(w)),jnp.conj(V.T),(1,0)),(1,0)))
-            return expm
+        ## exponential and logarithm, closed forms for SO(2) and SO(3) (Rodrigues' formula) and
+        # scaling and squaring Pade (jax.scipy.linalg.expm) and inverse scaling and squaring (logm) for N > 3.
+        # The SO(3) coefficients switch to their series close to 0 so all derivatives exist at the identity
+        def coefficients(theta2):
+            small = theta2 < 1e-3
+            _theta2 = jnp.where(small,1.,theta2)
+            theta = jnp.sqrt(_theta2)
+            A = jnp.where(small,1.-theta2/6.+theta2**2/120.,jnp.sin(theta)/theta) # sin(theta)/theta
+            B = jnp.where(small,.5-theta2/24.+theta2**2/720.,(1.-jnp.cos(theta))/_theta2) # (1-cos(theta))/theta^2
+            return (A,B)
+        def skew_logm(b): # general logarithm, projected to the Lie algebra
+            l = logm(b)
+            return .5*(l-l.T)
+        if N == 2:
+            def Expm(g):
+                (c,s) = (jnp.cos(g[1,0]),jnp.sin(g[1,0]))
+                return jnp.array([[c,-s],[s,c]])
+            def Logm(b):
+                theta = jnp.arctan2(b[1,0],b[0,0])
+                return jnp.array([[0.,-theta],[theta,0.]])
+        elif N == 3:
+            def Expm(g):
+                (A,B) = coefficients(.5*jnp.sum(jnp.square(g)))
+                return jnp.eye(3)+A*g+B*jnp.dot(g,g)
+            def Logm(b):
+                # log(b) = theta/sin(theta) (b-b^T)/2, close to theta = pi theta times the
+                # axis n from (b+b^T)/2 = c I + (1-c) n n^T with sign from (b-b^T)/2
+                skew = .5*(b-b.T)
+                c = .5*(jnp.trace(b)-1.)
+                s2 = .5*jnp.sum(jnp.square(skew)) # sin(theta)^2
+                small = s2 < 1e-6
+                s = jnp.sqrt(jnp.where(small,1.,s2))
+                theta = jnp.arctan2(jnp.where(s2 > 0.,jnp.sqrt(jnp.where(s2 > 0.,s2,1.)),0.),c)
+                coef = jnp.where(small,1.+s2/6.,theta/s)
+                nnT = (.5*(b+b.T)-c*jnp.eye(3))/jnp.maximum(1.-c,1.)
+                j = jnp.argmax(jnp.diag(nnT))
+                n = nnT[j]/jnp.sqrt(jnp.maximum(nnT[j,j],1e-3))
+                n = jnp.where(jnp.dot(n,jnp.stack((skew[2,1],skew[0,2],skew[1,0]))) < 0,-n,n)
+                K = jnp.array([[0.,-n[2],n[1]],[n[2],0.,-n[0]],[-n[1],n[0],0.]])
+                return jnp.where(c > -.9,coef*skew,theta*K)
+        else:
+            Expm = jax.scipy.linalg.expm
+            Logm = skew_logm
         self.Expm = Expm
-        def logm(b):
-            I = jnp.eye(b.shape[0])
-            res = jnp.zeros_like(b)
-            ITERATIONS = 20
-            for k in range(1, ITERATIONS):
-                res += pow(-1, k+1) * jnp.linalg.matrix_power(b-I, k)/k
-            return res
-        self.Logm = logm
+        self.Logm = Logm
 
         super(SON,self).initialize()
 
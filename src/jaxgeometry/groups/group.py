@@ -36,6 +36,7 @@ class LieGroup(EmbeddedManifold):
         self.e = jnp.eye(N,N) # identity element
         self.zeroLA = jnp.zeros((N,N)) # zero element in LA
         self.zeroV = jnp.zeros((self.dim,)) # zero element in V
+        self.signature = '(n,n)' # core shape of group and LA elements in batched operations
 
     def initialize(self):
         """ Initial group operations. To be called by sub-classes after definition of dimension, Expm etc.
@@ -59,10 +60,18 @@ class LieGroup(EmbeddedManifold):
             p # \RR^G_dim cotangent vector in coordinates
             pp # \RR^G_dim cotangent vector in coordinates
             mu # \RR^G_dim LA cotangent vector in coordinates
+
+        Group representations other than matrices (e.g. SO3q) define inv, bracket, C, L, R, dL, dR,
+        codL and codR before calling initialize.
+
+        Batched versions invs, Ls, Rs, exps, logs, psis, invpsis, brackets, Ads, invpbs and invpfs
+        take elements with arbitrary leading batch axes, e.g. gs of shape (B,N,N), broadcast
+        against each other.
         """
 
         ## group operations
-        self.inv = lambda g: jnp.linalg.inv(g)
+        if not hasattr(self,'inv'):
+            self.inv = lambda g: jnp.linalg.inv(g)
 
         ## group exp/log maps
         self.exp = self.Expm
@@ -82,62 +91,76 @@ class LieGroup(EmbeddedManifold):
             if xi.ndim == 2 and eta.ndim == 2:
                 return jnp.tensordot(xi,eta,(1,0))-jnp.tensordot(eta,xi,(1,0))
             elif xi.ndim == 3 and eta.ndim == 3:
-                return jnp.tensordot(xi,eta,(1,0)).dimshuffle((0,2,1,3))-jnp.tensordot(eta,xi,(1,0)).dimshuffle((0,2,1,3))
+                return jnp.tensordot(xi,eta,(1,0)).transpose((0,2,1,3))-jnp.tensordot(eta,xi,(1,0)).transpose((0,2,3,1))
             else:
                 assert(False)
-        self.bracket =  bracket
+        if not hasattr(self,'bracket'):
+            self.bracket =  bracket
+        # inverse of the derivative of exp, dexpinv(xi,eta) = sum_k B_k/k! ad_xi^k(eta)
+        # with Bernoulli numbers B_k, truncated after ad_xi^order
+        def dexpinv(xi,eta,order=4):
+            B = (1.,-1/2,1/6,0.,-1/30,0.,1/42,0.,-1/30)
+            res = eta; adk = eta
+            for k in range(1,order+1):
+                adk = self.bracket(xi,adk)
+                if B[k] != 0.:
+                    res = res+B[k]/scipy.special.factorial(k)*adk
+            return res
+        self.dexpinv = dexpinv
         #C = bracket(eiLA,eiLA) # structure constants, debug
         #C = jnp.linalg.lstsq(eiLA.reshape((N*N*G_dim*G_dim,G_dim*G_dim*G_dim)),bracket(eiLA,eiLA).reshape((N*N*G_dim*G_dim))).reshape((G_dim,G_dim,G_dim)) # structure constants
-        self.C = jnp.zeros((self.dim,self.dim,self.dim)) # structure constants
-        for i in range(self.dim):
-            for j in range(self.dim):
-                xij = self.bracket(self.eiLA[:,:,i],self.eiLA[:,:,j])
-                #lC[i,j,:] = jnp.linalg.lstsq(
-                #    self.eiLA.reshape((self.N*self.N,self.dim)),
-                #    xij.flatten(),
-                #    rcond=-1
-                #)[0]
-                self.C = self.C.at[i,j].set(jnp.linalg.lstsq(
-                            self.eiLA.reshape(self.N*self.N, self.dim),
-                            xij.reshape(self.N*self.N)
-                            )[0])
+        # structure constants, [e_i,e_j] = C_ij^k e_k, all brackets solved in one least squares problem
+        # (in numpy, the basis is constant)
+        if not hasattr(self,'C'):
+            eiLA = np.array(self.eiLA)
+            xij = np.einsum('abi,bcj->acij',eiLA,eiLA)
+            xij = xij-xij.transpose((0,1,3,2))
+            self.C = jnp.array(np.linalg.lstsq(
+                        eiLA.reshape((self.N*self.N,self.dim)),
+                        xij.reshape((self.N*self.N,self.dim*self.dim)),
+                        rcond=None
+                        )[0].T.reshape((self.dim,self.dim,self.dim)))
 
         ## surjective mapping \psi:\RR^G_dim\rightarrow G
         self.psi = lambda hatxi: self.exp(self.VtoLA(hatxi))
         self.invpsi = lambda g: self.LAtoV(self.log(g))
         def dpsi(hatxi,v=None):
             dpsi = jax.jacrev(self.psi)(hatxi)
-            if v:
-                return jnp.tensordot(dpsi,v,(2,0))
+            if v is not None:
+                return jnp.tensordot(dpsi,v,(self.e.ndim,0))
             return dpsi
         self.dpsi = dpsi
         def dinvpsi(g,vg=None):
             dinvpsi = jax.jacrev(self.invpsi)(g)
-            if vg:
-                return jnp.tensordot(dinvpsi,vg,((1,2),(0,1)))
+            if vg is not None:
+                return jnp.tensordot(dinvpsi,vg,(tuple(range(1,self.e.ndim+1)),tuple(range(self.e.ndim))))
             return dinvpsi
         self.dinvpsi = dinvpsi        
 
         ## left/right translation
-        self.L = lambda g,h: jnp.tensordot(g,h,(1,0)) # left translation L_g(h)=gh
-        self.R = lambda g,h: jnp.tensordot(h,g,(1,0)) # right translation R_g(h)=hg
-        # pushforward of L/R of vh\in T_hG
-        #dL = lambda g,h,vh: theano.gradient.Rop(L(theano.gradient.disconnected_grad(g),h).flatten(),h,vh).reshape((N,N))
+        if not hasattr(self,'L'):
+            self.L = lambda g,h: jnp.tensordot(g,h,(1,0)) # left translation L_g(h)=gh
+            self.R = lambda g,h: jnp.tensordot(h,g,(1,0)) # right translation R_g(h)=hg
+        # pushforward of L/R of vh\in T_hG, dL_g(vh) = g vh and dR_g(vh) = vh g,
+        # vh possibly with trailing batch axes. Without vh, the Jacobians d(gh)/dh and d(hg)/dh
         def dL(g,h,vh=None):
-            dL = jax.jacrev(self.L,1)(g,h)
             if vh is not None:
-                return jnp.tensordot(dL,vh,((2,3),(0,1)))
-            return dL
-        self.dL = dL
+                return jnp.tensordot(g,vh,(1,0))
+            return jnp.einsum('ik,jl->ijkl',g,jnp.eye(self.N))
+        if not hasattr(self,'dL'):
+            self.dL = dL
         def dR(g,h,vh=None):
-            dR = jax.jacrev(self.R,1)(g,h)
             if vh is not None:
-                return jnp.tensordot(dR,vh,((2,3),(0,1)))
-            return dR
-        self.dR = dR
-        # pullback of L/R of vh\in T_h^*G
-        self.codL = lambda g,h,vh: self.dL(g,h,vh).T
-        self.codR = lambda g,h,vh: self.dR(g,h,vh).T
+                return jnp.moveaxis(jnp.tensordot(vh,g,(1,0)),-1,1)
+            return jnp.einsum('ik,lj->ijkl',jnp.eye(self.N),g)
+        if not hasattr(self,'dR'):
+            self.dR = dR
+        # cotangent lift of L/R of ph\in T_h^*G to T_gh^*G and T_hg^*G, the pullbacks by L_g^-1 and R_g^-1,
+        # codL_g(ph) = g^-T ph and codR_g(ph) = ph g^-T
+        if not hasattr(self,'codL'):
+            self.codL = lambda g,h,ph: self.dL(self.inv(g).T,h,ph)
+        if not hasattr(self,'codR'):
+            self.codR = lambda g,h,ph: self.dR(self.inv(g).T,h,ph)
 
         ## actions
         self.Ad = lambda g,xi: self.dR(self.inv(g),g,self.dL(g,self.e,xi))
@@ -160,6 +183,23 @@ class LieGroup(EmbeddedManifold):
             self.invcopf = lambda g,alpha: self.codR(g,self.e,alpha) # right invariance pushforward from LA^* to Tg^*G
             self.infgen = lambda xi,g: self.dL(g,self.e,xi) # infinitesimal generator
 
+        ## batched operations over leading axes
+        e = self.signature; v = '(d)'
+        batch = lambda f,ins,out: jnp.vectorize(f,signature=','.join(ins)+'->'+out)
+        self.invs = batch(self.inv,(e,),e)
+        self.Ls = batch(self.L,(e,e),e)
+        self.Rs = batch(self.R,(e,e),e)
+        self.exps = batch(self.exp,(e,),e)
+        self.logs = batch(self.log,(e,),e)
+        self.VtoLAs = batch(self.VtoLA,(v,),e)
+        self.LAtoVs = batch(self.LAtoV,(e,),v)
+        self.psis = batch(self.psi,(v,),e)
+        self.invpsis = batch(self.invpsi,(e,),v)
+        self.brackets = batch(self.bracket,(e,e),e)
+        self.Ads = batch(self.Ad,(e,e),e)
+        self.invpbs = batch(self.invpb,(e,e),e)
+        self.invpfs = batch(self.invpf,(e,e),e)
+
     def __str__(self):
         return "abstract Lie group"
 
@@ -55,6 +55,7 @@ class Ellipsoid(EmbeddedManifold):
         k = jnp.argmin(jnp.abs(v))
         ek = jnp.eye(3)[:,k]
         b2 = ek-v[k]*v
+        b2 = b2/jnp.linalg.norm(b2)
         b3 = cross(b1,b2)
         return jnp.stack((b1,b2,b3),axis=1)
 
@@ -100,8 +101,8 @@ class Ellipsoid(EmbeddedManifold):
         EmbeddedManifold.__init__(self,F,2,3,invF=invF)
 
         # action of matrix group on elements
-        self.act = lambda g,x: jnp.tensordot(g,x,(1,0))
-        self.acts = lambda g,x: jnp.tensordot(g,x,(2,0))
+        self.act = lambda g,x: jnp.tensordot(g,x,(1,0)) if g.ndim == 2 else qrotate(g,x) # matrices or unit quaternions (SO3q)
+        self.acts = lambda g,x: jnp.tensordot(g,x,(2,0)) if g.ndim == 3 else jax.vmap(qrotate,(0,None))(g,x)
 
 
     def __str__(self):
@@ -27,15 +27,18 @@ from jaxgeometry.manifolds.manifold import *
 class landmarks(Manifold):
     """ LDDMM landmark manifold """
 
+    def poly_basis(self,q,mode='reduced'):
+        """ orthonormal basis of the polynomials of degree < order evaluated at the landmarks,
+        for Laplacian kernel etc. (N x codim/m, or completed to N x N if mode='complete') """
+        x = q[0].reshape((-1,self.m))
+        P = jnp.stack([jnp.prod(x**jnp.array(e),1) for e in itertools.product(range(self.order),repeat=self.m) if sum(e) < self.order],1)
+        return jnp.linalg.qr(P,mode=mode)[0]
+
     def get_B(self,q):
         """ dual space basis for Laplacian kernel etc. """
-        PT = jnp.vstack((jnp.ones(self.N),q[0].reshape((self.N,self.m)).T))
-        #codim = self.m*(self.N-PT.shape[0])
-        #svd = jax.scipy.linalg.svd(PT)
-        #V = svd[2].T[:,::-1] # reverse order
-        V = jax.lax.linalg.eigh(PT.T@PT)[0]
-
-        return jnp.kron(V,jnp.eye(self.m))
+        V = self.poly_basis(q,mode='complete')
+        c = self.codim//self.m
+        return self.kron_eye(jnp.hstack((V[:,c:],V[:,:c])))
     
     def Bkernel(self,q):
         """ dual space basis for Laplacian kernel etc., kernel """
@@ -45,7 +48,9 @@ class landmarks(Manifold):
         """ dual space basis for Laplacian kernel etc., subspace of polynomials """     
         return self.get_B(q)[:,self.dim-self.codim:]
 
-    def __init__(self,N=1,m=2,k_alpha=1.,k_sigma=None,kernel='Gaussian',order=2):
+    def __init__(self,N=1,m=2,k_alpha=1.,k_sigma=None,kernel='Gaussian',order=2,solver='cholesky',cg_block=32,kernel_tile=None,
+                 approximation=None,approximation_rank=100,nystrom_points=None,nugget=1e-3,approximation_key=None,
+                 fgt_tol=None):
         Manifold.__init__(self)
 
         self.N = N # number of landmarks
@@ -110,26 +115,234 @@ class landmarks(Manifold):
 
         # in coordinates
         self.k_q = lambda q1,q2: self.k(q1.reshape((-1,self.m))[:,np.newaxis,:]-q2.reshape((-1,self.m))[np.newaxis,:,:])
-        self.K = lambda q1,q2: (self.k_q(q1,q2)[:,:,np.newaxis,np.newaxis]*jnp.eye(self.m)[np.newaxis,np.newaxis,:,:]).transpose((0,2,1,3)).reshape((q1.size,q2.size))
+        self.K = lambda q1,q2: self.kron_eye(self.k_q(q1,q2))
         # differentials
         self.dk_q = lambda q1,q2: jax.vmap(jax.vmap(lambda x1,x2: self.dk(x1-x2),(0,None)),(None,0))(q1.reshape((-1,self.m)),q2.reshape((-1,self.m)))
         self.d2k_q = lambda q1,q2: jax.vmap(jax.vmap(lambda x1,x2: self.d2k(x1-x2),(0,None)),(None,0))(q1.reshape((-1,self.m)),q2.reshape((-1,self.m)))
 
+        ##### Approximate kernels:
+        # approximation='rff' (random Fourier features of the Gaussian and K0-K4 kernels) or 'nystrom'
+        # (Nystrom factorisation on the inducing points nystrom_points, e.g. a template or a grid, see set_nystrom_points)
+        # replaces k_q(q1,q2) by Phi(q1)Phi(q2)^T with features Phi of rank approximation_rank,
+        # so kernel sums cost O(N rank). gsharp is then (k_q(q,q)+nugget I) \otimes I_m, inverted by
+        # the Woodbury identity. The error is estimated by kernel_error_bound and kernel_error
+        self.approximation = approximation
+        self.approximation_rank = approximation_rank
+        self.nugget = nugget if approximation is not None else 0.
+        if self.approximation is not None:
+            if not self.std_basis:
+                raise ValueError('kernel approximations require a standard basis kernel')
+            self.k_q_exact = self.k_q
+            if self.approximation == 'rff':
+                # frequencies of the kernel in units of k_sigma, Gaussian for the Gaussian kernel, 
+                # multivariate t with 2n+1 degrees of freedom for the Matern kernels Kn 
+                _key = jax.random.PRNGKey(seed) if approximation_key is None else approximation_key
+                n_frequencies = self.approximation_rank//2
+                if self.kernel == 'Gaussian':
+                    scale = 1.
+                    frequencies = jax.random.normal(_key,(n_frequencies,self.m))
+                elif self.kernel in ['K0','K1','K2','K3','K4']:
+                    n = int(self.kernel[1])
+                    scale = [1.,2.,12.,120.,1680.][n] # k(0)/k_alpha
+                    (key1,key2) = jax.random.split(_key)
+                    frequencies = jax.random.normal(key1,(n_frequencies,self.m))/jnp.sqrt(jax.random.chisquare(key2,2*n+1,(n_frequencies,1)))
+                else:
+                    raise ValueError('random Fourier features not available for kernel %s' % self.kernel)
+                def features(q):
+                    W = jnp.dot(jnp.tensordot(q.reshape((-1,self.m)),self.inv_k_sigma,(1,1)),frequencies.T)
+                    return jnp.sqrt(self.k_alpha*scale/n_frequencies)*jnp.concatenate((jnp.cos(W),jnp.sin(W)),1)
+            elif self.approximation == 'nystrom':
+                # fixed inducing points z, features Phi(x) = L^-1 k(z,x) with L L^T = k(z,z)
+                if nystrom_points is None:
+                    raise ValueError('Nystrom approximation requires nystrom_points')
+                self.set_nystrom_points(nystrom_points)
+                def features(q):
+                    return jax.scipy.linalg.solve_triangular(self.nystrom_L,self.k_q_exact(self.nystrom_points,q),lower=True).T
+            else:
+                raise ValueError('unknown kernel approximation %s' % self.approximation)
+            self.features = features
+            self.k_q = lambda q1,q2: jnp.dot(self.features(q1),self.features(q2).T)
+
         ##### Metric:
         def gsharp(q):
             if self.std_basis:
-                return self.K(q[0],q[0])
+                return self.K(q[0],q[0])+self.nugget*jnp.eye(q[0].size)
             else:
-                B = self.get_B(q)
-                Bkernel = B[:,:self.dim-self.codim]
-                Bpoly = B[:,self.dim-self.codim:]
-                gsharpB = jnp.einsum('ji,jk,kl->il',Bkernel,self.K(q[0],q[0]),Bkernel)
-                gsharpextB = jax.scipy.linalg.block_diag((gsharpB),jnp.eye(self.codim))
-                return jnp.einsum('ij,jk,lk->il',B,gsharpextB,B)
+                return self.kron_eye(cpd_gsharp(q))
+        # for the conditionally positive definite kernels, gsharp = (Pi k_q Pi + QQ^T) \otimes I_m
+        # with Q = poly_basis(q) and Pi = I-QQ^T the projection onto the kernel of the polynomials
+        def cpd_gsharp(q):
+            Q = self.poly_basis(q)
+            Pi = jnp.eye(self.N)-jnp.dot(Q,Q.T)
+            return jnp.linalg.multi_dot((Pi,self.k_q(q[0],q[0]),Pi))+jnp.dot(Q,Q.T)
 
         self.gsharp = gsharp
 
+        ##### Kernel operator:
+        # for the standard basis kernels gsharp = k_q(q,q) \otimes I_m, and the metric is applied,
+        # inverted and factorised through the N x N scalar kernel matrix without forming gsharp.
+        # solver is 'cholesky' or 'cg' (conjugate gradients with a block Jacobi preconditioner
+        # on blocks of cg_block consecutive landmarks, log-determinant by stochastic Lanczos quadrature)
+        self.solver = solver
+        self.cg_block = cg_block
+        # kernel sums K(q1,q2)p are dense, or in kernel_tile x kernel_tile blocks with memory
+        # O(N) (see tile_sum) if kernel_tile is set
+        self.kernel_tile = kernel_tile
+        # with fgt_tol set, Gaussian kernel sums in 2 and 3 dimensions use the fast Gauss transform
+        # (see fgt) with error at most fgt_tol*k_alpha*sum_j |p_j| when its estimated cost is lower
+        self.fgt_tol = fgt_tol
+        self.fgt_crossover = .3 # relative cost of a transform term and a kernel evaluation (see examples/benchmarks)
+        def K_matvec(q1,q2,p):
+            P = p.reshape((q2.size//self.m,-1))
+            if self.approximation is not None:
+                return jnp.dot(self.features(q1),jnp.dot(self.features(q2).T,P)).flatten()
+            if self.use_fgt(q1.size//self.m,q2.size//self.m):
+                return self.k_alpha*fgt(self.fgt_coords(q2),P,self.fgt_coords(q1),fgt_parameters(self.m,self.fgt_tol)).flatten()
+            if self.kernel_tile is None:
+                return jnp.dot(self.k_q(q1,q2),P).flatten()
+            return tile_sum(lambda x1,x2p: self.k(x1-x2p[0])*x2p[1],q1.reshape((-1,self.m)),(q2.reshape((-1,self.m)),P),self.kernel_tile).flatten()
+        self.K_matvec = K_matvec
+        def dK_matvec(q1,q2,p):
+            # sum_j p_j d_c k(q1_i-q2_j), shape (N1,m,m)
+            P = p.reshape((-1,self.m))
+            if self.approximation is not None:
+                # derivative of the approximate kernel, sum_r (Phi(q2)^T P)_rb d_c Phi(q1_i)_r
+                dPhi = jax.vmap(jax.jacfwd(lambda x: self.features(x)[0]))(q1.reshape((-1,self.m)))
+                return jnp.einsum('rb,irc->ibc',jnp.dot(self.features(q2).T,P),dPhi)
+            if self.use_fgt(q1.size//self.m,q2.size//self.m):
+                (box,order,offsets,_) = fgt_parameters(self.m,self.fgt_tol)
+                data = fgt_moments(self.fgt_coords(q2),P,box,order)
+                dG = lax.map(jax.jacfwd(lambda t: fgt_eval(data,t,box,order,offsets)),self.fgt_coords(q1),batch_size=256)
+                return self.k_alpha*jnp.einsum('ibu,uc->ibc',dG,self.inv_k_sigma)
+            if self.kernel_tile is None:
+                return jnp.einsum('jic,jb->ibc',self.dk_q(q1,q2),P)
+            return tile_sum(lambda qi,qpj: jnp.outer(qpj[1],self.dk(qi-qpj[0])),q1.reshape((-1,self.m)),(q2.reshape((-1,self.m)),P),self.kernel_tile)
+        self.dK_matvec = dK_matvec
+        # structured metric operations used by Riemannian.metric instead of dense matrices
+        self.metric_overrides = {}
+        if self.std_basis:
+            self.metric_overrides['sharp'] = lambda q,p: self.K_matvec(q[0],q[0],p)+self.nugget*p
+            self.metric_overrides['flat'] = lambda q,v: self.K_solve(q,v)
+            self.metric_overrides['orthFrame'] = lambda q: self.kron_eye(jnp.linalg.cholesky(self.k_q(q[0],q[0])+self.nugget*jnp.eye(q[0].size//self.m)))
+            def logAbsDetsharp(q,A=None):
+                if A is not None:
+                    return jnp.linalg.slogdet(jnp.tensordot(self.gsharp(q),A,(1,0)))[1]
+                if self.approximation is not None: # matrix determinant lemma
+                    Phi = self.features(q[0])
+                    L = jnp.linalg.cholesky(self.nugget*jnp.eye(Phi.shape[1])+jnp.dot(Phi.T,Phi))
+                    return self.m*(2.*jnp.sum(jnp.log(jnp.diag(L)))+(Phi.shape[0]-Phi.shape[1])*jnp.log(self.nugget))
+                if self.solver == 'cholesky':
+                    return 2.*self.m*jnp.sum(jnp.log(jnp.diag(jnp.linalg.cholesky(self.k_q(q[0],q[0])))))
+                return self.m*logdet_slq(lambda u: self.K_matvec(q[0],q[0],u),self.N) # scalar kernel, p of shape (N,)
+            self.metric_overrides['logAbsDetsharp'] = logAbsDetsharp
+            def Gamma_trace(q):
+                # gsharp^kl Gamma^i_kl = sum_b dk(q_a-q_b) + m gsharp (sum_b g_ab dk(q_a-q_b))
+                kq = self.k_q(q[0],q[0])
+                gq = jax.scipy.linalg.cho_solve((jnp.linalg.cholesky(kq),True),jnp.eye(self.N))
+                dkq = self.dk_q(q[0],q[0]) # dkq[b,a] = dk(q_a-q_b)
+                return dkq.sum(0).flatten()+self.m*self.K_matvec(q[0],q[0],jnp.einsum('ab,bai->ai',gq,dkq))
+            if self.approximation is None:
+                self.metric_overrides['Gamma_trace'] = Gamma_trace
+        else:
+            # Pi k_q Pi is inverted on the kernel of Q^T by the saddle point system [[k_q,Q],[Q^T,0]],
+            # which has |det| equal to the determinant of the restriction
+            def saddle(q):
+                Q = self.poly_basis(q)
+                c = Q.shape[1]
+                return (Q,jnp.block([[self.k_q(q[0],q[0]),Q],[Q.T,jnp.zeros((c,c))]]))
+            def sharp(q,p):
+                Q = self.poly_basis(q)
+                P = p.reshape((self.N,-1))
+                QtP = jnp.dot(Q.T,P)
+                KPiP = self.K_matvec(q[0],q[0],P-jnp.dot(Q,QtP)).reshape(P.shape)
+                return (KPiP-jnp.dot(Q,jnp.dot(Q.T,KPiP))+jnp.dot(Q,QtP)).flatten()
+            self.metric_overrides['sharp'] = sharp
+            def flat(q,v):
+                (Q,S) = saddle(q)
+                V = v.reshape((self.N,-1))
+                QtV = jnp.dot(Q.T,V)
+                Y = jnp.linalg.solve(S,jnp.vstack((V-jnp.dot(Q,QtV),jnp.zeros_like(QtV))))[:self.N]
+                return (Y+jnp.dot(Q,QtV)).flatten()
+            self.metric_overrides['flat'] = flat
+            self.metric_overrides['orthFrame'] = lambda q: self.kron_eye(jnp.linalg.cholesky(cpd_gsharp(q)))
+            def logAbsDetsharp(q,A=None):
+                if A is not None:
+                    return jnp.linalg.slogdet(jnp.tensordot(self.gsharp(q),A,(1,0)))[1]
+                return self.m*jnp.linalg.slogdet(saddle(q)[1])[1]
+            self.metric_overrides['logAbsDetsharp'] = logAbsDetsharp
+
     
+    def kron_eye(self,A):
+        """ A \otimes I_m in the landmark coordinate ordering """
+        return (A[:,:,np.newaxis,np.newaxis]*jnp.eye(self.m)[np.newaxis,np.newaxis,:,:]).transpose((0,2,1,3)).reshape((A.shape[0]*self.m,A.shape[1]*self.m))
+
+    def K_solve(self,q,v):
+        """ solve gsharp(q) p = v using the kernel structure """
+        V = v.reshape((-1,self.m))
+        if self.approximation is not None:
+            # Woodbury, (Phi Phi^T+nugget I)^-1 = (I-Phi(nugget I+Phi^T Phi)^-1 Phi^T)/nugget
+            Phi = self.features(q[0])
+            L = jnp.linalg.cholesky(self.nugget*jnp.eye(Phi.shape[1])+jnp.dot(Phi.T,Phi))
+            return ((V-jnp.dot(Phi,jax.scipy.linalg.cho_solve((L,True),jnp.dot(Phi.T,V))))/self.nugget).flatten()
+        if self.solver == 'cholesky':
+            return jax.scipy.linalg.cho_solve((jnp.linalg.cholesky(self.k_q(q[0],q[0])),True),V).flatten()
+        elif self.solver == 'cg':
+            # block Jacobi preconditioner, the diagonal blocks of consecutive landmarks
+            b = min(self.cg_block,self.N); nb = self.N//b
+            qs = q[0].reshape((-1,self.m))
+            Ls = jax.vmap(lambda qb: jnp.linalg.cholesky(self.k_q(qb,qb)))(qs[:nb*b].reshape((nb,b,self.m)))
+            if nb*b < self.N: # remaining landmarks
+                Lr = jnp.linalg.cholesky(self.k_q(qs[nb*b:],qs[nb*b:]))
+            def precond(r):
+                R = r.reshape((-1,self.m))
+                Rb = jax.vmap(lambda L,r: jax.scipy.linalg.cho_solve((L,True),r))(Ls,R[:nb*b].reshape((nb,b,self.m))).reshape((-1,self.m))
+                if nb*b < self.N:
+                    Rb = jnp.concatenate((Rb,jax.scipy.linalg.cho_solve((Lr,True),R[nb*b:])))
+                return Rb.flatten()
+            return cg(lambda p: self.K_matvec(q[0],q[0],p),v,M=precond)
+        else:
+            raise ValueError('unknown solver %s' % self.solver)
+
+    def set_nystrom_points(self,z):
+        """ set the inducing points of the Nystrom approximation, shape (rank,m) """
+        z = jnp.array(z).reshape((-1,self.m))
+        Kzz = self.k_q_exact(z,z)
+        self.nystrom_points = z
+        self.nystrom_L = jnp.linalg.cholesky(Kzz+1e-5*jnp.trace(Kzz)/z.shape[0]*jnp.eye(z.shape[0]))
+        self.approximation_rank = z.shape[0]
+
+    def use_fgt(self,N1,N2):
+        """ crossover between dense (or tiled) kernel sums and the fast Gauss transform for N1 targets
+        and N2 sources, by the number of kernel evaluations vs. the estimated transform cost """
+        if self.fgt_tol is None or self.kernel != 'Gaussian' or self.m not in [2,3] or self.approximation is not None:
+            return False
+        return N1*N2 > self.fgt_crossover*(N1+N2)*fgt_parameters(self.m,self.fgt_tol)[3]
+
+    def fgt_coords(self,q):
+        """ points in units of the kernel width """
+        return jnp.tensordot(q.reshape((-1,self.m)),self.inv_k_sigma,(1,1))
+
+    def kernel_error_bound(self,q,delta=.05):
+        """ bound on the spectral norm error of the approximate N x N kernel matrix k_q(q,q).
+        'rff': Hoeffding and union bound over the landmark pairs, holds with probability 1-delta,
+        'nystrom': trace of the positive semidefinite error, deterministic """
+        N = q[0].size//self.m
+        k0 = self.k(jnp.zeros(self.m))
+        if self.approximation == 'rff':
+            return N*k0*jnp.sqrt(2.*np.log(max(N*(N-1),1)/delta)/(self.approximation_rank//2))
+        elif self.approximation == 'nystrom':
+            return N*k0-jnp.sum(self.features(q[0])**2)
+        return 0.
+
+    def kernel_error(self,q,x=None):
+        """ relative spectral norm error of the approximate kernel matrix k_q(q,q), or of k_q(x,q)
+        between points x of shape (n,m) and the landmarks if x is given, by dense evaluation """
+        if self.approximation is None:
+            return 0.
+        x = q[0] if x is None else x
+        K = self.k_q_exact(x,q[0])
+        return jnp.linalg.norm(K-self.k_q(x,q[0]),2)/jnp.linalg.norm(K,2)
+
     def update_coords(self,coords,new_chart):
         return (coords[0],new_chart)
 
@@ -255,13 +468,13 @@ class landmarks(Manifold):
         if xres:
             xd = xres
         elif xpts:
-            xd = np.complex(0,xpts)
+            xd = complex(0,xpts)
         else:
             assert(False)
         if yres:
             yd = yres
         elif ypts:
-            yd = np.complex(0,ypts)
+            yd = complex(0,ypts)
         else:
             assert(False)
 
@@ -272,9 +485,10 @@ class landmarks(Manifold):
         return (self.d2zip(grid),Nx,Ny)
 
 
-    def plotGrid(self,grid,Nx,Ny,coloring=True):
+    def plotGrid(self,grid,Nx,Ny,coloring=True,logdetJac=None):
         """
-        Plot grid
+        Plot grid, colored by the log-determinant of the deformation Jacobian, either given 
+        in logdetJac (e.g. from the Jacobians of M.deformation) or by finite differences of the grid
         """
 
         xmin = grid[:,0].min(); xmax = grid[:,0].max()
@@ -285,32 +499,17 @@ class landmarks(Manifold):
 
         color = 0.75
         colorgrid = np.full([Nx,Ny],color)
-        cm = plt.cm.get_cmap('gray')
+        cm = plt.get_cmap('gray')
         if coloring:
-            cm = plt.cm.get_cmap('coolwarm')
-            hx = (xmax-xmin) / (Nx-1)
-            hy = (ymax-ymin) / (Ny-1)
-            for i,j in itertools.product(range(Nx),range(Ny)):
-                p = grid[:,i,j]
-                xs = np.empty([0,2])
-                ys = np.empty([0,2])
-                if 0 < i:
-                    xs = np.vstack((xs,grid[:,i,j]-grid[:,i-1,j],))
-                if i < Nx-1:
-                    xs = np.vstack((xs,grid[:,i+1,j]-grid[:,i,j],))
-                if 0 < j:
-                    ys = np.vstack((ys,grid[:,i,j]-grid[:,i,j-1],))
-                if j < Ny-1:
-                    ys = np.vstack((ys,grid[:,i,j+1]-grid[:,i,j],))
-
-                Jx = np.mean(xs,0) / hx
-                Jy = np.mean(ys,0) / hy
-                J = np.vstack((Jx,Jy,)).T
-
-                A = .5*(J+J.T)-np.eye(2)
-                CSstrain = np.log(np.trace(A*A.T))
-                logdetJac = np.log(sp.linalg.det(J))
-                colorgrid[i,j] = logdetJac
+            cm = plt.get_cmap('coolwarm')
+            if logdetJac is None:
+                hx = (xmax-xmin) / (Nx-1)
+                hy = (ymax-ymin) / (Ny-1)
+                Jx = np.gradient(grid,hx,axis=1)
+                Jy = np.gradient(grid,hy,axis=2)
+                colorgrid = np.log(Jx[0]*Jy[1]-Jy[0]*Jx[1])
+            else:
+                colorgrid = np.array(logdetJac).reshape((Nx,Ny))
 
             cmin = np.min(colorgrid)
             cmax = np.max(colorgrid)
@@ -320,18 +519,11 @@ class landmarks(Manifold):
             print("mean color: ", np.mean(colorgrid))
 
         # plot lines
-        for i,j in itertools.product(range(Nx),range(Ny)):
-            if i < Nx-1:
-                plt.plot(grid[0,i:i+2,j],grid[1,i:i+2,j],color=cm(colorgrid[i,j]))
-            if j < Ny-1:
-                plt.plot(grid[0,i,j:j+2],grid[1,i,j:j+2],color=cm(colorgrid[i,j]))
-
-        #for i in range(0,grid.shape[1]):
-        #    plt.plot(grid[0,i,:],grid[1,i,:],color)
-        ## plot x lines
-        #for i in range(0,grid.shape[2]):
-        #    plt.plot(grid[0,:,i],grid[1,:,i],color)
-
+        points = grid.transpose((1,2,0))
+        segments = np.concatenate((np.stack((points[:-1,:],points[1:,:]),2).reshape((-1,2,2)),
+                                   np.stack((points[:,:-1],points[:,1:]),2).reshape((-1,2,2))))
+        colors = np.concatenate((colorgrid[:-1,:].flatten(),colorgrid[:,:-1].flatten()))
+        plt.gca().add_collection(mpl.collections.LineCollection(segments,colors=cm(colors)))
 
         plt.xlim(xmin-border,xmax+border)
         plt.ylim(ymin-border,ymax+border)
@@ -32,4 +32,26 @@ n_steps = 100
 default_method = 'euler'
 #default_method = 'rk4'
 
+# adaptive step size integrators (embedded Runge-Kutta pairs, e.g. 'dopri5'):
+default_rtol = 1e-5 # relative error tolerance
+default_atol = 1e-5 # absolute error tolerance
+default_max_steps = 4096 # maximal number of attempted steps
 
+# fixed point iterations for implicit symplectic integrators ('verlet', 'midpoint')
+default_implicit_iterations = 4
+
+# gradients through integrate/integrate_sde ('checkpoint' or 'adjoint', None for plain scan):
+default_gradient = None
+default_checkpoint_segments = None # None: sqrt(n_steps) segments
+default_max_chart_updates = 64 # chart changes recorded for 'adjoint', nan gradients if exceeded
+
+# matrix-free solves (conjugate gradients) and log-determinants (stochastic Lanczos quadrature):
+default_cg_tol = 1e-5
+default_cg_maxiter = None
+default_slq_probes = 16
+default_slq_steps = 20
+
+# batched minimisation (L-BFGS in lax.while_loop, e.g. for batched Logarithms):
+default_lbfgs_maxiter = 100
+default_lbfgs_tol = 1e-6 # gradient norm
+default_lbfgs_history = 10
@@ -37,7 +37,7 @@ def initialize(M,Exp=None):
     
     # constraint
     def _c(chart,x,v,y,ychart):
-        xT,chartT = M.Exp((x,chart),v)
+        xT,chartT = Exp((x,chart),v)
         y_chartT = M.update_coords((y,ychart),chartT)
         return jnp.sqrt(M.dim)*(xT-y_chartT[0])
     def c(chart,x,v,y,ychart):
@@ -0,0 +1,125 @@
+## This file is part of Jax Geometry
+#
+# Copyright (C) 2021, Stefan Sommer (sommer@di.ku.dk)
+# https://bitbucket.org/stefansommer/jaxgeometry
+#
+# Jax Geometry is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Jax Geometry is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Jax Geometry. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from jaxgeometry.setup import *
+
+# multilevel Monte Carlo (Giles 2008) estimation of E[f] for functionals f of
+# sde paths. Level l uses n_steps0*2**l steps, the level l > 0 samples are the
+# differences f(fine)-f(coarse) of paths coupled by summing pairs of the fine
+# increments to get the coarse increments
+def MLMC(f,d,eps,T=T,n_steps0=2,N0=100,L0=2,Lmax=10,alpha=None,beta=None,batch=1024,key=None):
+    """ multilevel Monte Carlo estimate of E[f] with root mean square error eps
+
+    f(dts,dWs) evaluates the functional on the path driven by the increments dWs
+    of dimension d, e.g. lambda dts,dWs: h(M.Brownian_coords(x,dts,dWs)[1][-1]).
+    The number of samples per level is chosen from the observed variances and
+    levels are added until the estimated bias is below eps/sqrt(2). alpha and
+    beta are the weak error and variance decay rates, estimated from the levels
+    if None. Returns (estimate, info) with the per level sample counts, means,
+    variances and costs (in steps), the total cost and the estimated cost of
+    single level Monte Carlo at the finest level for the same accuracy
+    """
+    if key is None:
+        key = random.PRNGKey(seed)
+
+    # level samples (Y,P_fine) from N paths, in batches. Batches are padded to a power
+    # of two (at most batch) so that each level compiles for a few sizes only
+    def _level_samples(key,l,N):
+        n = n_steps0*2**l
+        _dts = dts(T,n)
+        dW = jax.vmap(lambda key: dWs(d,_dts,_key=key))(random.split(key,N))
+        Pf = jax.vmap(f,(None,0))(_dts,dW)
+        if l == 0:
+            return (Pf,Pf)
+        Pc = jax.vmap(f,(None,0))(dts(T,n//2),dW.reshape((N,n//2,2,d)).sum(2))
+        return (Pf-Pc,Pf)
+    _level_samples = jit(_level_samples,static_argnums=(1,2))
+    def level_samples(key,l,N):
+        Ys = []; Pfs = []
+        for i in range(0,N,batch):
+            m = min(batch,N-i)
+            (Y,Pf) = _level_samples(random.fold_in(key,i),l,min(batch,1 << (m-1).bit_length()))
+            Ys.append(Y[:m]); Pfs.append(Pf[:m])
+        return (jnp.concatenate(Ys),jnp.concatenate(Pfs))
+
+    # sums of Y, Y**2, Pf, Pf**2 per level
+    sums = []; Ns = []
+    cost = lambda l: n_steps0*2**l+(n_steps0*2**(l-1) if l > 0 else 0)
+    def update(l,dN):
+        nonlocal key
+        key,subkey = random.split(key)
+        (Y,Pf) = level_samples(subkey,l,dN)
+        s = np.array([jnp.sum(Y),jnp.sum(Y**2),jnp.sum(Pf),jnp.sum(Pf**2)],dtype=np.float64)
+        if l == len(sums):
+            sums.append(s); Ns.append(dN)
+        else:
+            sums[l] += s; Ns[l] += dN
+
+    def moments():
+        N = np.array(Ns,dtype=np.float64)
+        S = np.array(sums)
+        means = S[:,0]/N
+        Vs = np.maximum(S[:,1]/N-means**2,0.)
+        Vfs = np.maximum(S[:,3]/N-(S[:,2]/N)**2,0.)
+        return (means,Vs,Vfs)
+
+    # regression of log2 |means|, log2 Vs over the levels l >= 1, at least .5
+    def rate(ys):
+        if len(ys) < 2:
+            return .5
+        ls = np.arange(1,len(ys)+1)
+        return max(.5,-np.polyfit(ls,np.log2(np.maximum(np.abs(ys),1e-30)),1)[0])
+
+    L = L0
+    for l in range(L+1):
+        update(l,N0)
+    while True:
+        (means,Vs,Vfs) = moments()
+        _alpha = alpha if alpha is not None else rate(means[1:])
+        _beta = beta if beta is not None else rate(Vs[1:])
+        # optimal sample allocation
+        Cs = np.array([cost(l) for l in range(L+1)])
+        Nopt = np.ceil(2*eps**(-2)*np.sqrt(Vs/Cs)*np.sum(np.sqrt(Vs*Cs))).astype(int)
+        dNs = np.maximum(0,Nopt-np.array(Ns))
+        if np.any(dNs > .01*np.array(Ns)):
+            for l in range(L+1):
+                if dNs[l] > 0:
+                    update(l,int(dNs[l]))
+            continue
+        # convergence test, add level if bias too large
+        bias = np.max(np.abs(means[-2:])*np.array([2**(-_alpha),1.]))/(2**_alpha-1)
+        if bias <= eps/np.sqrt(2) or L == Lmax:
+            break
+        L += 1
+        update(L,N0)
+
+    (means,Vs,Vfs) = moments()
+    Cs = np.array([cost(l) for l in range(L+1)])
+    info = {'levels': L,
+            'n_steps': n_steps0*2**np.arange(L+1),
+            'N': np.array(Ns),
+            'means': means,
+            'variances': Vs,
+            'costs': np.array(Ns)*Cs,
+            'cost': np.sum(np.array(Ns)*Cs),
+            'cost_MC': 2*eps**(-2)*Vfs[-1]*n_steps0*2**L,
+            'alpha': _alpha,
+            'beta': _beta,
+            'converged': L < Lmax or bias <= eps/np.sqrt(2)}
+    return (np.sum(means),info)
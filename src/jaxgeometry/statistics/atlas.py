@@ -0,0 +1,125 @@
+## This file is part of Jax Geometry
+#
+# Copyright (C) 2021, Stefan Sommer (sommer@di.ku.dk)
+# https://bitbucket.org/stefansommer/jaxgeometry
+#
+# Jax Geometry is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Jax Geometry is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Jax Geometry. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from jaxgeometry.setup import *
+from jaxgeometry.utils import *
+
+import os
+from jax.sharding import Mesh, PartitionSpec
+
+###############################################################
+# Template (atlas) estimation for populations of shapes:      #
+# alternating batched geodesic shooting from the template to  #
+# the subjects and template updates along the mean of the     #
+# shooting vectors (gradient descent for the Frechet mean)    #
+###############################################################
+def initialize(M,Exp=None):
+    """ M: manifold, usually landmarks, Exp: exponential map (default M.Exp) """
+
+    if Exp is None:
+        Exp = M.Exp
+
+    def loss(x,v,y):
+        (x1,chart1) = Exp(x,v)
+        y_chart1 = M.update_coords(y,chart1)
+        return 1./M.dim*jnp.sum(jnp.square(x1 - y_chart1[0]))
+
+    # shooting of a batch of subjects, sharded across the local devices
+    mesh = Mesh(np.array(jax.devices()),('subjects',))
+    # returns (shooting vectors, losses, success), with success false for shootings that diverged:
+    # the zero vector has loss |x-y|^2/dim, so larger or non-finite losses are failures
+    def _shoot(x,ys,vs,maxiter,tol):
+        def shoot(y,v0):
+            (v,f) = lbfgs(lambda w: loss(x,w,y),v0,maxiter=maxiter,tol=tol)[:2]
+            f0 = loss(x,jnp.zeros_like(v0),y)
+            return (v,f,jnp.logical_and(jnp.all(jnp.isfinite(v)),f <= f0))
+        return jax.vmap(shoot)(ys,vs)
+    shoot = jit(lambda x,ys,vs,maxiter,tol: jax.shard_map(partial(_shoot,maxiter=maxiter,tol=tol),mesh=mesh,
+                                                           in_specs=(PartitionSpec(),PartitionSpec('subjects'),PartitionSpec('subjects')),
+                                                           out_specs=PartitionSpec('subjects'),check_vma=False)(x,ys,vs),static_argnames=['maxiter'])
+    M.atlas_shoot = shoot
+
+    def update(x,vs,weights,step_size):
+        v = jnp.tensordot(weights,vs,(0,0))/jnp.sum(weights)
+        return (Exp(x,step_size*v),jnp.sqrt(M.norm2(x,v)))
+    update = jit(update)
+
+    def atlas(ys,x0,num_steps=20,batch_size=None,step_size=1.,maxiter=default_lbfgs_maxiter,tol=default_lbfgs_tol,
+              checkpoint=None,checkpoint_every=1,key=None):
+        """ estimate a template from subjects ys = (coords,charts) stacked along the first axis.
+        Each step shoots from the template to a minibatch of batch_size subjects (all if None),
+        warm started from their previous shooting vectors, and moves the template along the
+        mean shooting vector. Shootings that diverge (non-finite loss or a loss above that of the
+        zero vector) are restarted from zero, and left out of the update with loss nan and
+        shooting vector zero if they fail again. With checkpoint set to a file name, the state is
+        saved there every checkpoint_every steps and a run is resumed from it if it exists.
+        Returns (template, shooting vectors, matching losses, templates along the steps) """
+        n = ys[0].shape[0]
+        batch_size = n if batch_size is None else batch_size
+        devices = mesh.devices.size
+        padded = -(-batch_size//devices)*devices
+        _key = jax.random.PRNGKey(seed) if key is None else key
+
+        # state
+        x = x0
+        vs = np.zeros((n,M.dim))
+        losses = np.full(n,np.nan)
+        steps = (x0,)
+        start = 0
+        if checkpoint is not None and os.path.exists(checkpoint):
+            state = np.load(checkpoint)
+            x = (jnp.array(state['x']),jnp.array(state['chart']))
+            vs = state['vs']; losses = state['losses']
+            start = int(state['step']); _key = jnp.array(state['key'])
+            steps = tuple(zip(jnp.array(state['steps']),jnp.array(state['step_charts'])))
+
+        for i in range(start,num_steps):
+            if batch_size < n:
+                (_key,subkey) = jax.random.split(_key)
+                idx = np.array(jax.random.choice(subkey,n,(batch_size,),replace=False))
+            else:
+                idx = np.arange(n)
+            idx = np.concatenate((idx,np.full(padded-batch_size,idx[0])))
+            ysbatch = (ys[0][idx],ys[1][idx])
+
+            (vbatch,lbatch,ok) = shoot(x,ysbatch,jnp.array(vs[idx]),maxiter,tol)
+            if not np.all(np.array(ok)):
+                # shootings that diverged from their warm start are restarted from zero
+                (vbatch,lbatch,ok) = shoot(x,ysbatch,jnp.where(ok[:,np.newaxis],vbatch,0.),maxiter,tol)
+            # padded and diverged subjects have zero weight in the update, the latter restart from zero
+            ok = np.logical_and(np.array(ok),np.arange(padded) < batch_size)
+            (vbatch,lbatch) = (np.where(ok[:,np.newaxis],np.array(vbatch),0.),np.where(ok,np.array(lbatch),np.nan))
+            vs[idx[:batch_size]] = vbatch[:batch_size]; losses[idx[:batch_size]] = lbatch[:batch_size]
+
+            if np.any(ok):
+                (x,vnorm) = update(x,jnp.array(vbatch),jnp.array(ok,dtype=vbatch.dtype),step_size)
+            else:
+                vnorm = np.nan
+            steps += (x,)
+            if i % 10 == 0:
+                print("Step {} | mean loss: {:0.6e} | |v|: {:0.6e} | diverged: {}".format(i,np.nanmean(lbatch) if np.any(ok) else np.nan,vnorm,batch_size-np.sum(ok)))
+
+            if checkpoint is not None and ((i+1) % checkpoint_every == 0 or i+1 == num_steps):
+                tmp = checkpoint+'.tmp.npz'
+                np.savez(tmp,x=np.array(x[0]),chart=np.array(x[1]),vs=vs,losses=losses,step=i+1,key=np.array(_key),
+                         steps=np.array([s[0] for s in steps]),step_charts=np.array([s[1] for s in steps]))
+                os.replace(tmp,checkpoint)
+
+        return (x,vs,losses,steps)
+    M.atlas = atlas
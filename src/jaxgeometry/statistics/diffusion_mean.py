@@ -25,7 +25,7 @@ from jaxgeometry.stochastics.guided_process import *
 
 from jaxgeometry.statistics.iterative_mle import *
 
-def initialize(M):
+def initialize(M,integration='ito',gradient=default_gradient,antithetic=False):
 
     # guide function
     phi = lambda q,v,s: jnp.tensordot((1/s)*jnp.linalg.cholesky(M.g(q)).T,M.StdLog(q,M.F((v,q[1]))).flatten(),(1,0))
@@ -34,7 +34,7 @@ def initialize(M):
     
     (Brownian_coords_guided,sde_Brownian_coords_guided,chart_update_Brownian_coords_guided,log_p_T,neg_log_p_Ts) = get_guided(
         M,M.sde_Brownian_coords,M.chart_update_Brownian_coords,phi,
-        lambda x,s: s*jnp.linalg.cholesky(M.gsharp(x)),A,logdetA)
+        lambda x,s: s*jnp.linalg.cholesky(M.gsharp(x)),A,logdetA,integration=integration,gradient=gradient,antithetic=antithetic)
 
     # optimization setup
     N = 1 # bridge samples per datapoint
@@ -61,9 +61,9 @@ def initialize(M):
             states_flat = ((x,m,v),*s)
             return (states_flat,tree_def,subtree_defs),chart
     
-    M.diffusion_mean = lambda samples,params=(x[0]+.1*np.random.normal(size=M.dim),jnp.array(.2,dtype="float32")),N=N,num_steps=80: \
+    M.diffusion_mean = lambda samples,params=(x[0]+.1*np.random.normal(size=M.dim),jnp.array(.2,dtype="float32")),N=N,num_steps=80,key=None,qmc=False: \
             iterative_mle(samples,\
                 neg_log_p_Ts,\
                 params,params_inds,params_update,x[1],_dts,M,\
-                N=N,num_steps=num_steps,step_size=1e-2)
+                N=N,num_steps=num_steps,step_size=1e-2,key=key,qmc=qmc)
 
@@ -21,13 +21,23 @@ from jaxgeometry.setup import *
 
 from jax.example_libraries import optimizers
 
-def iterative_mle(obss,neg_log_p_Ts,params,params_inds,params_update,chart,_dts,M,N=1,step_size=1e-1,num_steps=50):
+def iterative_mle(obss,neg_log_p_Ts,params,params_inds,params_update,chart,_dts,M,N=1,step_size=1e-1,num_steps=50,key=None,qmc=False):
+    """ the noise of the N bridges per observation is drawn on the fly from keys folded from key and the step,
+    or with qmc=True from scrambled Sobol sequences with Brownian bridge construction (N a power of 2) """
     opt_init, opt_update, get_params = optimizers.adam(step_size)
     vg = jax.value_and_grad(neg_log_p_Ts,params_inds)
+    if key is None:
+        key = random.PRNGKey(seed)
 
     def step(step, params, opt_state, chart):
         params = get_params(opt_state)
-        value,grads = vg(params[0],chart,obss,dWs(len(obss[0])*N*M.dim,_dts).reshape(-1,_dts.shape[0],N,M.dim),_dts,*params[1:])
+        if qmc:
+            seeds = random.randint(random.fold_in(key,step),(len(obss[0]),),0,2**31-1)
+            dW = jnp.stack([dWs_qmc(M.dim,_dts,num=N,seed=int(seed)).transpose((1,0,2)) for seed in seeds])
+        else:
+            keys = jax.vmap(lambda key: random.split(key,N))(random.split(random.fold_in(key,step),len(obss[0])))
+            dW = FoldInNoise(keys,M.dim)
+        value,grads = vg(params[0],chart,obss,dW,_dts,*params[1:])
         opt_state = opt_update(step, grads, opt_state)
         opt_state,chart = params_update(opt_state, chart)
         return (value,opt_state,chart)
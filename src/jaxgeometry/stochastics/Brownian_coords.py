@@ -20,16 +20,20 @@
 from jaxgeometry.setup import *
 from jaxgeometry.utils import *
 
-def initialize(M):
-    """ Brownian motion in coordinates """
+def initialize(M,christoffel=True):
+    """ Brownian motion in coordinates, with christoffel=False the drift is computed by M.Gamma_trace without forming Gamma """
 
     def sde_Brownian_coords(c,y):
         t,x,chart,s = c
         dt,dW = y
 
-        gsharpx = M.gsharp((x,chart))
-        X = s*jnp.linalg.cholesky(gsharpx)
-        det = -.5*(s**2)*jnp.einsum('kl,ikl->i',gsharpx,M.Gamma_g((x,chart)))
+        if christoffel:
+            (_,_,gsharpx,_,Gamma) = M.metric_bundle((x,chart))
+            det = -.5*(s**2)*jnp.einsum('kl,ikl->i',gsharpx,Gamma)
+            X = s*jnp.linalg.cholesky(gsharpx)
+        else:
+            det = -.5*(s**2)*M.Gamma_trace((x,chart))
+            X = s*M.orthFrame((x,chart))
         sto = jnp.tensordot(X,dW,(1,0))
         return (det,sto,X,0.)
     
@@ -51,4 +55,4 @@ def initialize(M):
     
     M.sde_Brownian_coords = sde_Brownian_coords
     M.chart_update_Brownian_coords = chart_update_Brownian_coords
-    M.Brownian_coords = jit(lambda x,dts,dWs,stdCov=1.: integrate_sde(sde_Brownian_coords,integrator_ito,chart_update_Brownian_coords,x[0],x[1],dts,dWs,stdCov)[0:3])
+    M.Brownian_coords = jit(lambda x,dts,dWs,stdCov=1.,integrator=integrator_ito: integrate_sde(sde_Brownian_coords,integrator,chart_update_Brownian_coords,x[0],x[1],dts,dWs,stdCov)[0:3],static_argnames=['integrator'])
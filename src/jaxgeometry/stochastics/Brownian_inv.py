@@ -29,11 +29,29 @@ def initialize(G):
         t,g,_,sigma = c
         dt,dW = y
 
-        X = jnp.tensordot(G.invpf(g,G.eiLA),sigma,(2,0))
-        det = -.5*jnp.tensordot(jnp.diagonal(G.C,0,2).sum(1),X,(0,2))
-        sto = jnp.tensordot(X,dW,(2,0))
+        X = jnp.tensordot(G.invpf(g,G.eiLA),sigma,(g.ndim,0))
+        det = -.5*jnp.tensordot(jnp.diagonal(G.C,0,2).sum(1),X,(0,g.ndim))
+        sto = jnp.tensordot(X,dW,(g.ndim,0))
+        return (det,sto,X,jnp.zeros_like(sigma))
+
+    # Lie algebra valued form for Lie group integrators
+    def sde_Brownian_inv_LA(c,y):
+        t,g,_,sigma = c
+        dt,dW = y
+
+        X = jnp.tensordot(G.eiLA,sigma,(g.ndim,0))
+        det = -.5*jnp.tensordot(jnp.diagonal(G.C,0,2).sum(1),X,(0,g.ndim))
+        sto = jnp.tensordot(X,dW,(g.ndim,0))
         return (det,sto,X,jnp.zeros_like(sigma))
 
     G.sde_Brownian_inv = sde_Brownian_inv
-    G.Brownian_inv = lambda g,dts,dWt,sigma=jnp.eye(G.dim): integrate_sde(G.sde_Brownian_inv,integrator_stratonovich,None,g,None,dts,dWt,sigma)[0:3]
+    G.sde_Brownian_inv_LA = sde_Brownian_inv_LA
+    def Brownian_inv(g,dts,dWt,sigma=jnp.eye(G.dim),method=None):
+        """ method None: Euler-Heun in the embedding space, 'rkmk1'/'rkmk2': Lie group integrator """
+        if method is not None:
+            return integrate_sde(G.sde_Brownian_inv_LA,integrator_stratonovich_group(G,method),None,g,None,dts,dWt,sigma)[0:3]
+        # groups with a projection to_group (e.g. SO3q) are projected after each step
+        chart_update = (lambda g,chart,*cy: (G.to_group(g),chart,*cy)) if hasattr(G,'to_group') else None
+        return integrate_sde(G.sde_Brownian_inv,integrator_stratonovich,chart_update,g,None,dts,dWt,sigma)[0:3]
+    G.Brownian_inv = Brownian_inv
 
@@ -41,12 +41,12 @@ def initialize(M,k=None):
         dpt = dp((x[0],chart),x[1])
         
         sigmas_adW = sigmas_a*dW[:,np.newaxis]
-        sigmadWq = jnp.tensordot(K(x[0],sigmas_x),sigmas_adW.flatten(),(1,0))
-        sigmadWp = jnp.tensordot(
-             jax.jacrev(
-                 lambda lq: jnp.tensordot(K(lq,sigmas_x),sigmas_adW.flatten(),(1,0)).flatten(),
-                 )(x[0]),
-            x[1],(1,0))
+        # noise field at the landmarks and its derivative in direction p by one JVP
+        if M.kernel_tile is None:
+            sigmadW = lambda lq: jnp.tensordot(K(lq,sigmas_x),sigmas_adW.flatten(),(1,0))
+        else:
+            sigmadW = lambda lq: tile_sum(lambda q,sa: k(q-sa[0])*sa[1],lq.reshape((-1,M.m)),(sigmas_x,sigmas_adW),M.kernel_tile).flatten()
+        (sigmadWq,sigmadWp) = jax.jvp(sigmadW,(x[0],),(x[1],))
     
         X = None # to be implemented
         det = jnp.stack((dqt,dpt))
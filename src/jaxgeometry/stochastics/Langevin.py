@@ -57,6 +57,34 @@ def initialize(M):
                             chart),
                 *cy)
 
-    M.Langevin_qp = lambda q,p,l,s,dts,dWt: integrate_sde(sde_Langevin,integrator_ito,chart_update_Langevin,jnp.stack((q[0],p)),q[1],dts,dWt,l,s)
+    # BAOAB splitting: symplectic half steps around exact Ornstein-Uhlenbeck step in p
+    d2Hdp2 = jax.hessian(M.H,argnums=1)
+    def integrator_BAOAB(sde_f,chart_update=None):
+        if chart_update == None: # no chart update
+            chart_update = lambda xp,chart,*cy: (xp,chart,*cy)
 
-    M.Langevin = lambda q,p,l,s,dts,dWt: M.Langevin_qp(q,p,l,s,dts,dWt)[0:3]
+        def BAOAB(c,y):
+            t,x,chart,l,s = c
+            dt,dW = y
+            f = lambda x: jnp.stack((dq((x[0],chart),x[1]),dp((x[0],chart),x[1])))
+
+            # BA
+            x = symplectic_euler_pq(f,x,dt/2)
+
+            # O: dp = -l d^2H/dp^2 p dt + s dW, exact for fixed q.
+            # covariance s^2 dt phi1(-2 l dt d^2H/dp^2), phi1(A) = A^{-1}(e^A-I)
+            G = d2Hdp2((x[0],chart),x[1])
+            Z = jnp.zeros_like(G)
+            phi1 = jax.scipy.linalg.expm(jnp.block([[-2*l*dt*G,jnp.eye(G.shape[0])],[Z,Z]]))[:G.shape[0],G.shape[0]:]
+            p = jnp.dot(jax.scipy.linalg.expm(-l*dt*G),x[1])+s*jnp.dot(jnp.linalg.cholesky(phi1),dW)
+
+            # AB
+            x = symplectic_euler_qp(f,jnp.stack((x[0],p)),dt/2)
+            return ((t+dt,*chart_update(x,chart,l,s)),)*2
+
+        return BAOAB
+
+    integrators = {'ito': integrator_ito, 'BAOAB': integrator_BAOAB}
+    M.Langevin_qp = lambda q,p,l,s,dts,dWt,integration='ito': integrate_sde(sde_Langevin,integrators[integration],chart_update_Langevin,jnp.stack((q[0],p)),q[1],dts,dWt,l,s)
+
+    M.Langevin = lambda q,p,l,s,dts,dWt,integration='ito': M.Langevin_qp(q,p,l,s,dts,dWt,integration)[0:3]
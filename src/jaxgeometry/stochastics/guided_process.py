@@ -20,13 +20,25 @@
 from jaxgeometry.setup import *
 from jaxgeometry.utils import *
 
+from jax.scipy.special import logsumexp
+
 #######################################################################
 # guided processes, Delyon/Hu 2006                                    #
 #######################################################################
 
 # hit target v at time t=Tend
-def get_guided(M,sde,chart_update,phi,sqrtCov=None,A=None,logdetA=None,method='DelyonHu',integration='ito'):
-    """ guided diffusions """
+def get_guided(M,sde,chart_update,phi,sqrtCov=None,A=None,logdetA=None,method='DelyonHu',integration='ito',gradient=default_gradient,antithetic=False):
+    """ guided diffusions 
+
+    integration is 'stratonovich' or an Ito scheme: 'ito' (Euler-Maruyama), 'milstein' or 'srk'
+    gradient is passed on to integrate_sde ('checkpoint' for memory bounded gradients, 'adjoint'
+    is not supported as the guiding term is singular at T and cannot be integrated backwards stably)
+    antithetic: log_p_T pairs each noise sample with its negation
+    """
+    if gradient == 'adjoint':
+        raise ValueError("adjoint gradients are not supported for guided processes, use gradient='checkpoint'")
+
+    integrators = {'ito': integrator_ito, 'milstein': integrator_milstein, 'srk': integrator_srk, 'stratonovich': integrator_stratonovich}
 
     def sde_guided(c,y):
         t,x,chart,log_likelihood,log_varphi,T,v,*cy = c
@@ -58,7 +70,7 @@ def get_guided(M,sde,chart_update,phi,sqrtCov=None,A=None,logdetA=None,method='D
         ## correction factor
         ytilde = jnp.tensordot(X,h*(T-t),1)
         tp1 = t+dt
-        if integration == 'ito':
+        if integration != 'stratonovich':
             xtp1 = x+dt*(det+jnp.tensordot(X,h,1))+sto
         elif integration == 'stratonovich':
             tx = x+sto
@@ -95,21 +107,30 @@ def get_guided(M,sde,chart_update,phi,sqrtCov=None,A=None,logdetA=None,method='D
         v_new = M.update_coords((v,chart),chart_new)[0]
         return (x_new,chart_new,log_likelihood,log_varphi,T,v_new,*ys_new)
     
-    guided = jit(lambda x,v,dts,dWs,*ys: integrate_sde(sde_guided,integrator_ito if integration == 'ito' else integrator_stratonovich,chart_update_guided,x[0],x[1],dts,dWs,0.,0.,jnp.sum(dts),M.update_coords(v,x[1])[0] if chart_update else v,*ys)[0:5])
+    guided = jit_integrate(lambda x,v,dts,dWs,*ys,output=None: integrate_sde(sde_guided,integrators[integration],chart_update_guided,x[0],x[1],dts,dWs,0.,0.,jnp.sum(dts),M.update_coords(v,x[1])[0] if chart_update else v,*ys,gradient=gradient,output=output)[0:5])
    
-    def _log_p_T(guided,A,phi,x,v,dW,dts,*ys):
-        """ Monte Carlo approximation of log transition density from guided process """
+    def _log_p_T(guided,A,phi,x,v,dW,dts,*ys,ess=False):
+        """ Monte Carlo approximation of log transition density from guided process
+        
+        dW is either increments with the samples along axis 1 or noise with a batch of
+        keys along axis 0 (e.g. FoldInNoise(random.split(key,N),d)). With ess=True,
+        the effective sample size of the importance weights is returned as well """
         T = jnp.sum(dts)
         
         Cxv = jnp.sum(phi(x,M.update_coords(v,x[1])[0],*ys)**2)
         
         # sample
-        log_varphis = jax.vmap(lambda dW: guided(x,v,dts,dW,*ys)[4][-1],1)(dW)
+        _log_varphis = lambda dW: jax.vmap(lambda dW: guided(x,v,dts,dW,*ys,output='final')[4],0 if callable(dW) else 1)(dW)
+        log_varphis = _log_varphis(dW)
+        if antithetic:
+            log_varphis = jnp.concatenate((log_varphis,_log_varphis(antithetic_noise(dW) if callable(dW) else -dW)))
         
-        log_varphi = jnp.log(jnp.mean(jnp.exp(log_varphis)))
+        log_varphi = logsumexp(log_varphis)-jnp.log(log_varphis.shape[0])
         #(_,_,X,*_) = sde((T,v,chart,*cy),y)
         _logdetA = logdetA(x,*ys) if logdetA is not None else -2*jnp.linalg.slogdet(X)[1]
         log_p_T = .5*_logdetA-.5*x[0].shape[0]*jnp.log(2.*jnp.pi*T)-Cxv/(2.*T)+log_varphi
+        if ess:
+            return (log_p_T,jnp.exp(2*logsumexp(log_varphis)-logsumexp(2*log_varphis)))
         return log_p_T
     log_p_T = partial(_log_p_T,guided,A,phi)
 
@@ -20,6 +20,13 @@
 from jaxgeometry.setup import *
 from jaxgeometry.params import *
 
+import jax.flatten_util
+import jax.scipy.special
+import jax.scipy.sparse.linalg
+import scipy.special
+import itertools
+import functools
+
 #######################################################################
 # various useful functions                                            #
 #######################################################################
@@ -74,17 +81,150 @@ def dts(T=T,n_steps=n_steps):
 seed = 42
 global key
 key = jax.random.PRNGKey(seed)
-def dWs(d,_dts=None,num=1):
+
+# Brownian increments drawn on the fly from a key, the increment of step i is
+# sqrt(dt)*N(0,I) with the normal drawn from fold_in(key,i). Increments are thus
+# reproducible independently of how paths are batched, vmapped or sharded. key
+# can have leading batch axes (e.g. from random.split), the object is a pytree
+# and can be passed to jitted and vmapped functions. Used as dWs in integrate_sde
+@jax.tree_util.register_pytree_node_class
+class FoldInNoise(object):
+    """ Brownian increments from key, dW(i,t,dt) is the increment of step i on [t,t+dt] """
+
+    def __init__(self,key,shape):
+        self.key = key
+        self.shape = (shape,) if isinstance(shape,int) else tuple(shape)
+
+    def __call__(self,i,t,dt):
+        return jnp.sqrt(dt)*random.normal(random.fold_in(self.key,jnp.asarray(i).astype(jnp.int32)),self.shape)
+
+    def __str__(self):
+        return "fold_in noise of shape %s" % (self.shape,)
+
+    def tree_flatten(self):
+        return ((self.key,),self.shape)
+
+    @classmethod
+    def tree_unflatten(cls,shape,children):
+        return cls(children[0],shape)
+
+# virtual Brownian tree (Gaines and Lyons, Li et al.): Brownian motion W on [t0,t1]
+# defined by recursive Brownian bridge sampling at interval midpoints with the keys
+# of the nodes of a binary tree split from key. W(t) is found by descending the tree
+# to depth log2((t1-t0)/tol) and interpolating linearly in the final interval, i.e.
+# in O(log) time and O(1) memory, and increments W(s,t) = W(t)-W(s) are consistent
+# for arbitrary query times. Thus steps need not be fixed in advance, and the same
+# path is recovered e.g. in adjoint backward passes. Usable as dWs in integrate_sde
+@jax.tree_util.register_pytree_node_class
+class BrownianTree(object):
+    """ Brownian motion on [t0,t1] from key, W(s,t) is the increment on [s,t] """
+
+    def __init__(self,key,shape,t0=0.,t1=T,tol=1e-5):
+        self.key = key
+        self.shape = (shape,) if isinstance(shape,int) else tuple(shape)
+        self.t0 = t0; self.t1 = t1; self.tol = tol
+        self.depth = max(1,int(np.ceil(np.log2((t1-t0)/tol))))
+
+    # W(t) with W(t0) = 0
+    def Wt(self,t):
+        t = jnp.clip(t,self.t0,self.t1)
+        key,subkey = random.split(self.key)
+        W1 = jnp.sqrt(self.t1-self.t0)*random.normal(subkey,self.shape)
+
+        def descend(i,c):
+            (a,b,Wa,Wb,key) = c
+            keyl,keyr,subkey = random.split(key,3)
+            m = .5*(a+b)
+            Wm = .5*(Wa+Wb)+.5*jnp.sqrt(b-a)*random.normal(subkey,self.shape)
+            left = t < m
+            return (jnp.where(left,a,m),jnp.where(left,m,b),
+                    jnp.where(left,Wa,Wm),jnp.where(left,Wm,Wb),
+                    jnp.where(left,keyl,keyr))
+
+        (a,b,Wa,Wb,_) = lax.fori_loop(0,self.depth,descend,
+                                      (jnp.array(self.t0,t.dtype),jnp.array(self.t1,t.dtype),jnp.zeros(self.shape),W1,key))
+        return Wa+(t-a)/(b-a)*(Wb-Wa)
+
+    def W(self,s,t):
+        return self.Wt(t)-self.Wt(s)
+
+    # noise function for integrate_sde
+    def __call__(self,i,t,dt):
+        return self.W(t,t+dt)
+
+    def __str__(self):
+        return "Brownian tree of shape %s on [%g,%g] with tolerance %g" % (self.shape,self.t0,self.t1,self.tol)
+
+    def tree_flatten(self):
+        return ((self.key,),(self.shape,self.t0,self.t1,self.tol))
+
+    @classmethod
+    def tree_unflatten(cls,aux,children):
+        return cls(children[0],*aux)
+
+# noise realisations with num paths and increments of dimension d. If _key is None,
+# the module global key is split and updated, otherwise the call is pure (and can
+# be jitted with static d and num). The increments equal those of FoldInNoise with
+# the key (num == 1) or the keys random.split(key,num)
+def dWs(d,_dts=None,num=1,_key=None):
     global key
-    keys = jax.random.split(key,num=num+1)
-    key = keys[0]
-    subkeys = keys[1:]
-    if _dts == None:
+    if _key is None:
+        key, _key = jax.random.split(key)
+    if _dts is None:
         _dts = dts()
+    _dWs = lambda key: jax.vmap(FoldInNoise(key,d))(jnp.arange(_dts.shape[0]),jnp.cumsum(_dts)-_dts,_dts)
     if num == 1:
-        return jnp.sqrt(_dts)[:,None]*random.normal(subkeys[0],(_dts.shape[0],d))
+        return _dWs(_key)
     else:
-        return jax.vmap(lambda subkey: jnp.sqrt(_dts)[:,None]*random.normal(subkey,(_dts.shape[0],d)))(subkeys)    
+        return jax.vmap(_dWs)(random.split(_key,num))
+
+# antithetic noise, the increments of noise negated
+def antithetic_noise(noise):
+    return jax.tree_util.Partial(_antithetic,noise)
+def _antithetic(noise,i,t,dt):
+    return -noise(i,t,dt)
+
+# Brownian bridge construction on the grid cumsum(_dts): matrix B with W = B z for
+# standard normal z, z[0] determining W(T), z[1] W at the midpoint and so on by
+# bisection, i.e. the leading coordinates of z determine the coarse path shape
+def Brownian_bridge_matrix(_dts):
+    ts = np.concatenate(([0.],np.cumsum(np.asarray(_dts,dtype=np.float64))))
+    n = ts.shape[0]-1
+    B = np.zeros((n+1,n))
+    B[n,0] = np.sqrt(ts[n])
+    k = 1
+    intervals = [(0,n)]
+    while intervals:
+        (l,r) = intervals.pop(0)
+        if r-l < 2:
+            continue
+        m = (l+r)//2
+        B[m] = ((ts[r]-ts[m])*B[l]+(ts[m]-ts[l])*B[r])/(ts[r]-ts[l])
+        B[m,k] = np.sqrt((ts[m]-ts[l])*(ts[r]-ts[m])/(ts[r]-ts[l]))
+        k += 1
+        intervals += [(l,m),(m,r)]
+    return B[1:]
+
+# randomized quasi Monte Carlo noise realisations (num,n_steps,d): scrambled Sobol
+# points mapped to normals, with the Brownian bridge construction assigning the
+# first Sobol coordinates to the coarse path shape. num should be a power of 2.
+# Sobol points are used for the leading sobol_dim of the n_steps*d coordinates (at
+# most qmc.Sobol.MAXDIM, the default), the remaining fine scale coordinates are
+# pseudo-random normals
+def dWs_qmc(d,_dts=None,num=1,seed=None,sobol_dim=None):
+    from scipy.stats import qmc
+    if _dts is None:
+        _dts = dts()
+    n = _dts.shape[0]
+    m = min(n*d,qmc.Sobol.MAXDIM) if sobol_dim is None else sobol_dim
+    if m > qmc.Sobol.MAXDIM:
+        raise ValueError('Sobol points are limited to %d dimensions' % qmc.Sobol.MAXDIM)
+    rng = np.random.default_rng(seed)
+    u = qmc.Sobol(m,scramble=True,seed=rng).random(num)
+    z = jax.scipy.special.ndtri(jnp.clip(jnp.array(u,dtype=_dts.dtype),1e-7,1.-1e-7))
+    z = jnp.concatenate((z,jnp.array(rng.standard_normal((num,n*d-m)),dtype=_dts.dtype)),axis=1).reshape((num,n,d))
+    W = jnp.einsum('ij,njd->nid',jnp.array(Brownian_bridge_matrix(_dts),dtype=_dts.dtype),z)
+    return jnp.diff(W,axis=1,prepend=jnp.zeros((num,1,d),dtype=W.dtype))
 
 # Integrator (deterministic)
 def integrator(ode_f,chart_update=None,method=default_method):
@@ -107,18 +247,485 @@ def integrator(ode_f,chart_update=None,method=default_method):
         k4 = ode_f((t,x + dt*k3,chart),y[1:])
         return ((t+dt,*chart_update(x + dt/6*(k1 + 2*k2 + 2*k3 + k4),chart,y[1:])),)*2
 
+    # Stormer-Verlet, x = (q,p) stacked, implicit for non-separable Hamiltonians:
+    def verlet(c,y):
+        t,x,chart = c
+        dt,*_ = y
+        f = lambda x: ode_f((t,x,chart),y[1:])
+        x = symplectic_euler_qp(f,symplectic_euler_pq(f,x,dt/2),dt/2)
+        return ((t+dt,*chart_update(x,chart,y[1:])),)*2
+
+    # implicit midpoint:
+    def midpoint(c,y):
+        t,x,chart = c
+        dt,*_ = y
+        f = lambda x: ode_f((t+dt/2,x,chart),y[1:])
+        x = fixed_point(lambda xp: x + dt*f(.5*(x+xp)),x + dt*f(x))
+        return ((t+dt,*chart_update(x,chart,y[1:])),)*2
+
     if method == 'euler':
         return euler
     elif method == 'rk4':
         return rk4
+    elif method == 'verlet':
+        return verlet
+    elif method == 'midpoint':
+        return midpoint
     else:
         assert(False)
 
-# return symbolic path given ode and integrator
-def integrate(ode,chart_update,x,chart,dts,*ys):
-    _,xs = lax.scan(integrator(ode,chart_update),
-            (0.,x,chart),
+# fixed point iteration x = f(x) with fixed number of iterations (reverse differentiable)
+def fixed_point(f,x0,iterations=default_implicit_iterations):
+    return lax.fori_loop(0,iterations,lambda i,x: f(x),x0)
+
+# symplectic Euler steps for ode f on x = (q,p) stacked, f returning (dq,dp).
+# pq: p implicit, q explicit; qp: q implicit, p explicit (the adjoint method).
+# The composition qp(h/2) o pq(h/2) is the Stormer-Verlet step
+def symplectic_euler_pq(f,x,h):
+    p = fixed_point(lambda p: x[1]+h*f(jnp.stack((x[0],p)))[1],x[1])
+    return jnp.stack((x[0]+h*f(jnp.stack((x[0],p)))[0],p))
+
+def symplectic_euler_qp(f,x,h):
+    q = fixed_point(lambda q: x[0]+h*f(jnp.stack((q,x[1])))[0],x[0])
+    return jnp.stack((q,x[1]+h*f(jnp.stack((q,x[1])))[1]))
+
+# embedded Runge-Kutta pairs for adaptive integration:
+# (c, A, b, e, P, order) with nodes c, Runge-Kutta matrix A, weights b (the stage
+# f(t+h,x_new) is appended last, FSAL), error weights e and dense output
+# coefficients P such that x(t+theta*h) = x + h*sum_j k_j*sum_l P[j][l]*theta**(l+1)
+adaptive_tableaux = {
+    # Dormand-Prince 5(4) with 4th order continuous extension (Hairer, Norsett, Wanner)
+    'dopri5': (
+        (0., 1/5, 3/10, 4/5, 8/9, 1.),
+        ((),
+         (1/5,),
+         (3/40, 9/40),
+         (44/45, -56/15, 32/9),
+         (19372/6561, -25360/2187, 64448/6561, -212/729),
+         (9017/3168, -355/33, 46732/5247, 49/176, -5103/18656)),
+        (35/384, 0., 500/1113, 125/192, -2187/6784, 11/84),
+        (-71/57600, 0., 71/16695, -71/1920, 17253/339200, -22/525, 1/40),
+        ((1., -8048581381/2820520608, 8663915743/2820520608, -12715105075/11282082432),
+         (0., 0., 0., 0.),
+         (0., 131558114200/32700410799, -68118460800/10900136933, 87487479700/32700410799),
+         (0., -1754552775/470086768, 14199869525/1410260304, -10690763975/1880347072),
+         (0., 127303824393/49829197408, -318862633887/49829197408, 701980252875/199316789632),
+         (0., -282668133/205662961, 2019193451/616988883, -1453857185/822651844),
+         (0., 40617522/29380423, -110615467/29380423, 69997945/29380423)),
+        5),
+}
+
+def integrate_adaptive(ode,chart_update,x,chart,dts,*ys,method='dopri5',rtol=default_rtol,atol=default_atol,max_steps=default_max_steps,buf=None):
+    """ adaptive step size integration with embedded Runge-Kutta pair
+
+    Steps are chosen by the error controller independently of dts. The
+    trajectory is returned at the times cumsum(dts) using the dense output
+    of the method, and ys are treated as piecewise constant inputs with ys[i]
+    active on the i'th interval. Chart updates are applied at accepted steps,
+    and if the chart changed the next step is restarted in the new chart
+    (k1 is recomputed instead of reused). Output points are in the chart of
+    the step they are interpolated from, or after the chart update if a
+    step ends on an output point. If buf is given, chart changes are recorded
+    in it, see chart_update_buffer, and (ts,xs,charts),buf is returned.
+    The loop is a lax.while_loop, i.e. forward-mode differentiable only,
+    use integrate(...,gradient='adjoint') for reverse mode.
+    """
+    (c,A,b,e,P,order) = adaptive_tableaux[method]
+    if chart_update is None: # no chart update
+        chart_update = lambda *args: args[0:2]
+
+    ts = jnp.cumsum(dts)
+    T = ts[-1]
+    _ys = lambda t: tuple([y[jnp.clip(jnp.searchsorted(ts,t,side='right'),0,ts.shape[0]-1)] for y in ys])
+    f = lambda t,x,chart: ode((t,x,chart),_ys(t))
+    lincomb = lambda ws,ks: sum([w*k for (w,k) in zip(ws,ks) if w != 0.])
+
+    def step(t,x,chart,h,k1):
+        ks = [k1]
+        for i in range(1,len(c)):
+            ks.append(f(t+c[i]*h,x+h*lincomb(A[i],ks),chart))
+        x_new = x+h*lincomb(b,ks)
+        ks.append(f(t+h,x_new,chart))
+        return (x_new,h*lincomb(e,ks),ks)
+
+    def body(carry):
+        (i,t,x,chart,h,k1,xs,charts,buf) = carry
+
+        last = h >= T-t
+        h = jnp.minimum(h,T-t)
+        (x_new,err,ks) = step(t,x,chart,h,k1)
+        t_new = jnp.where(last,T,t+h)
+
+        # error control
+        scale = atol+rtol*jnp.maximum(jnp.abs(x),jnp.abs(x_new))
+        err_norm = jnp.sqrt(jnp.mean(jnp.square(err/scale)))
+        accept = err_norm <= 1.
+        factor = jnp.where(jnp.isfinite(err_norm),jnp.clip(.9*err_norm**(-1./order),.2,10.),.2)
+
+        # dense output at requested times in (t,t_new]
+        thetas = (ts-t)/h
+        Q = jnp.stack(ks,-1)@jnp.array(P,dtype=x.dtype)
+        xs_interp = x+h*jnp.einsum('...l,nl->n...',Q,jnp.cumprod(jnp.tile(thetas[:,None],(1,Q.shape[-1])),1))
+        mask = accept & (ts > t) & (ts <= t_new)
+        xs = jnp.where(mask.reshape((-1,)+(1,)*x.ndim),xs_interp,xs)
+        if chart is not None:
+            charts = jnp.where(mask.reshape((-1,)+(1,)*chart.ndim),chart,charts)
+
+        # chart update at accepted step, FSAL unless chart changed
+        x_new_ = x_new
+        (x_new,chart_new) = chart_update(x_new,chart,_ys(t_new))
+        if chart is not None:
+            k1_new = lax.cond(jnp.any(chart_new != chart),
+                              lambda _: f(t_new,x_new,chart_new),
+                              lambda _: ks[-1],
+                              None)
+        else:
+            k1_new = ks[-1]
+        mask = accept & (ts == t_new)
+        xs = jnp.where(mask.reshape((-1,)+(1,)*x.ndim),x_new,xs)
+        if chart is not None:
+            charts = jnp.where(mask.reshape((-1,)+(1,)*chart.ndim),chart_new,charts)
+        if buf is not None:
+            j = jnp.searchsorted(ts,t_new)
+            buf = record_chart_update(buf,j,t_new-ts[j]+dts[j],(x_new_,),chart,jnp.where(accept,chart_new,chart))
+
+        return (i+1,
+                jnp.where(accept,t_new,t),
+                jnp.where(accept,x_new,x),
+                jnp.where(accept,chart_new,chart) if chart is not None else None,
+                h*factor,
+                jnp.where(accept,k1_new,k1),
+                xs,charts,buf)
+
+    t0 = jnp.zeros_like(T)
+    init = (0,t0,x,chart,dts[0],f(t0,x,chart),
+            jnp.full((ts.shape[0],)+x.shape,jnp.nan,dtype=x.dtype), # NaN where not reached within max_steps
+            jnp.tile(chart,(ts.shape[0],)+(1,)*chart.ndim) if chart is not None else None,
+            buf)
+    (_,_,_,_,_,_,xs,charts,buf) = lax.while_loop(lambda carry: (carry[1] < T) & (carry[0] < max_steps),body,init)
+    return (ts,xs,charts) if buf is None else ((ts,xs,charts),buf)
+
+# Runge-Kutta-Munthe-Kaas Lie group integrators for dg = invpf(g,xi(t,g)) with ode
+# returning xi in the Lie algebra. Steps are g_{n+1} = invtrns(g_n,exp(Omega)) with
+# Omega from a Runge-Kutta method in the Lie algebra, so g stays in the group
+# (c, A, b) of the underlying Runge-Kutta method, the order is the number of stages
+group_tableaux = {
+    'rkmk1': ((0.,), ((),), (1.,)), # Lie-Euler
+    'rkmk2': ((0., 1.), ((), (1.,)), (1/2, 1/2)), # Heun
+    'rkmk3': ((0., 1/2, 1.), ((), (1/2,), (-1., 2.)), (1/6, 2/3, 1/6)), # Kutta
+    'rkmk4': ((0., 1/2, 1/2, 1.), ((), (1/2,), (0., 1/2), (0., 0., 1.)), (1/6, 1/3, 1/3, 1/6)), # classical
+}
+
+def integrator_group(ode_f,G,method='rkmk4'):
+    (c,A,b) = group_tableaux[method]
+    order = len(b)
+    # g(t) = invtrns(g,exp(Omega(t))) gives Omega' = dexpinv_{sign*Omega}(xi)
+    sign = -1. if G.invariance == 'left' else 1.
+
+    def rkmk(c_,y):
+        t,g,_ = c_
+        dt,*_ = y
+        ks = []
+        for i in range(len(c)):
+            if not any(A[i]):
+                ks.append(ode_f((t,g,None),y[1:]))
+                continue
+            Omega = dt*sum([a*k for (a,k) in zip(A[i],ks) if a != 0.])
+            xi = ode_f((t+c[i]*dt,G.invtrns(g,G.exp(Omega)),None),y[1:])
+            ks.append(G.dexpinv(sign*Omega,xi,order-1))
+        Omega = dt*sum([bi*k for (bi,k) in zip(b,ks) if bi != 0.])
+        return ((t+dt,G.invtrns(g,G.exp(Omega)),None),)*2
+
+    return rkmk
+
+def integrate_group(ode,G,g,dts,*ys,method='rkmk4'):
+    _,gs = lax.scan(integrator_group(ode,G,method),
+            (0.,g,None),
             (dts,*ys))
+    return gs[0:2]
+
+# stochastic Lie group integrator (Stratonovich). sde_f returns (det,sto,X,*dcy)
+# in the Lie algebra, i.e. dg = invpf(g,det dt + X o dW). 'rkmk1' is the stochastic
+# Lie-Euler step g_{n+1} = invtrns(g_n,exp(det dt + sto)), 'rkmk2' the Heun variant
+def integrator_stratonovich_group(G,method='rkmk2'):
+    sign = -1. if G.invariance == 'left' else 1.
+
+    def integrator(sde_f,chart_update=None):
+        def rkmk(c,y):
+            t,g,chart,*cy = c
+            dt,dW = y
+
+            (det, sto, X, *dcy) = sde_f(c,y)
+            Omega = dt*det+sto
+            if method == 'rkmk2':
+                (dett, stot, *_) = sde_f((t+dt,G.invtrns(g,G.exp(Omega)),chart,*cy),y)
+                Omega = .5*(Omega+G.dexpinv(sign*Omega,dt*dett+stot,1))
+            cy_new = tuple([y+dt*dy for (y,dy) in zip(cy,dcy)])
+            return ((t+dt,G.invtrns(g,G.exp(Omega)),chart,*cy_new),)*2
+
+        return rkmk
+
+    return integrator
+
+# scan with gradient checkpointing: the steps are grouped in segments, and only the
+# carry at segment boundaries is stored for the backward pass, the steps inside a
+# segment are recomputed (with residuals saved according to policy, see
+# jax.checkpoint_policies). With sqrt(n) segments memory is O(sqrt(n)) states
+def scan_checkpoint(f,init,xs,segments=default_checkpoint_segments,policy=None):
+    n = jax.tree_util.tree_leaves(xs)[0].shape[0]
+    segments = max(1,int(np.sqrt(n))) if segments is None else segments
+    length = n//segments
+    m = segments*length
+    inner = jax.checkpoint(lambda c,xs: lax.scan(f,c,xs),policy=policy)
+    c,ys = lax.scan(inner,init,jax.tree_util.tree_map(lambda x: x[:m].reshape((segments,length)+x.shape[1:]),xs))
+    ys = jax.tree_util.tree_map(lambda y: y.reshape((m,)+y.shape[2:]),ys)
+    if m < n: # remaining steps
+        c,_ys = lax.scan(f,c,jax.tree_util.tree_map(lambda x: x[m:],xs))
+        ys = jax.tree_util.tree_map(lambda y,_y: jnp.concatenate((y,_y)),ys,_ys)
+    return (c,ys)
+
+def scan(f,init,xs,gradient=default_gradient,checkpoint_segments=default_checkpoint_segments,checkpoint_policy=None):
+    if gradient == 'checkpoint':
+        return scan_checkpoint(f,init,xs,checkpoint_segments,checkpoint_policy)
+    return lax.scan(f,init,xs)
+
+# outputs of a scan with the carry as output, according to the policy output:
+# None: all steps, 'final': the final carry only, k: every k'th step (and the final
+# step if k does not divide the number of steps), (reduce,init): the reduction
+# acc = reduce(acc,c) over the steps starting from init. Except for None, the
+# carry is not stacked, i.e. memory is independent of the number of steps.
+# With aux, f has carry (c,aux) where aux is not output, and (outputs,aux) is returned
+def scan_outputs(f,init,xs,output=None,aux=None,**kwargs):
+    if aux is None:
+        _f = lambda c,x: (lambda c,y: ((c,None),y))(*f(c[0],x))
+        return _scan_outputs(_f,(init,None),xs,output,**kwargs)[0]
+    return _scan_outputs(f,(init,aux),xs,output,**kwargs)
+
+def _scan_outputs(f,init,xs,output=None,**kwargs):
+    if output is None:
+        c,ys = scan(f,init,xs,**kwargs)
+        return (ys,c[1])
+    _f = lambda c,x: (f(c,x)[0],None)
+    if output == 'final':
+        return scan(_f,init,xs,**kwargs)[0]
+    elif isinstance(output,tuple):
+        (reduce,acc) = output
+        def fr(c,x):
+            (c,acc) = c
+            c = f(c,x)[0]
+            return ((c,reduce(acc,c[0])),None)
+        (c,acc) = scan(fr,(init,acc),xs,**kwargs)[0]
+        return (acc,c[1])
+    else: # every output'th step
+        n = jax.tree_util.tree_leaves(xs)[0].shape[0]
+        m = n//output
+        c,ys = scan(lambda c,xs: (lambda c: (c,c[0]))(lax.scan(_f,c,xs)[0]),init,
+                    jax.tree_util.tree_map(lambda x: x[:m*output].reshape((m,output)+x.shape[1:]),xs),**kwargs)
+        if m*output < n: # remaining steps
+            c,_ = lax.scan(_f,c,jax.tree_util.tree_map(lambda x: x[m*output:],xs))
+            ys = jax.tree_util.tree_map(lambda y,c: jnp.concatenate((y,c[None])),ys,c[0])
+        return (ys,c[1])
+
+# apply output policy to stacked outputs
+def select_outputs(ys,output=None):
+    if output is None:
+        return ys
+    elif output == 'final':
+        return jax.tree_util.tree_map(lambda y: y[-1],ys)
+    elif isinstance(output,tuple):
+        (reduce,acc) = output
+        return lax.scan(lambda acc,y: (reduce(acc,y),None),acc,ys)[0]
+    else:
+        n = jax.tree_util.tree_leaves(ys)[0].shape[0]
+        inds = np.arange(output-1,n,output)
+        inds = inds if n % output == 0 else np.append(inds,n-1)
+        return jax.tree_util.tree_map(lambda y: y[inds],ys)
+
+# chart changes for adjoint gradients: the forward pass records, for each chart change,
+# the step, the time from the start of the step to the change, the state before the
+# change and the previous chart in a buffer (m,steps,offsets,states,charts) holding up
+# to size changes, m counts all changes
+def chart_update_buffer(state,chart,dt,size=default_max_chart_updates):
+    return (jnp.zeros((),jnp.int32),jnp.full((size,),-1,jnp.int32),jnp.zeros((size,),jnp.result_type(dt)),
+            jax.tree_util.tree_map(lambda x: jnp.zeros((size,)+jnp.shape(x),jnp.result_type(x)),state),
+            jnp.zeros((size,)+chart.shape,chart.dtype))
+
+def record_chart_update(buf,i,offset,state,chart,chart_new):
+    (m,steps,offsets,states,charts) = buf
+    changed = jnp.any(chart_new != chart)
+    j = jnp.minimum(m,steps.shape[0]-1)
+    put = lambda xs,x: xs.at[j].set(jnp.where(changed,x,xs[j]))
+    return (m+changed,put(steps,i),put(offsets,offset),jax.tree_util.tree_map(put,states,state),put(charts,chart))
+
+# fixed step function with carry (t,x,chart,*cy) and no chart update followed by the chart
+# update update(t,state,chart,y) -> (state,chart) of state = (x,*cy), recording chart
+# changes in the aux carry (i,buf) for scan_outputs
+def record_chart_updates(step,update):
+    def _step(c,y):
+        (c,(i,buf)) = c
+        (t,x,chart,*cy) = step(c,y)[0]
+        (state,chart_new) = update(t,(x,*cy),chart,y)
+        c = (t,state[0],chart_new,*state[1:])
+        return ((c,(i+1,record_chart_update(buf,i,y[0],(x,*cy),chart,chart_new))),c)
+    return _step
+
+# continuous adjoint (backsolve): gradients are computed by integrating the state
+# backwards from the endpoint together with the adjoint a and the parameter
+# gradients, da/dt = -a df/dx, with rk4 on the forward time grid. Only the endpoint
+# is stored, i.e. memory is O(1) in the number of steps, at the price of backward
+# integration error. For the adaptive methods, the backward pass too uses rk4 on the
+# grid dts, so the accuracy of the gradients is set by dts and not by rtol/atol.
+# field(f,t,state,chart,y) returns the time derivative of state = (x,*cy) on the step
+# with input y = (dt,*ys). forward(f,x,chart,cy,inputs,buf) returns the trajectory
+# (ts,xs,charts,*cys) and, if buf is not None, the buffer with the chart changes
+# recorded, see chart_update_buffer. update(t,state,chart,y) is the chart update. The
+# backward pass integrates in the chart of each step, at recorded chart changes the
+# state is reset to the recorded state and a is pulled back through the update.
+# If more than max_chart_updates changes occur, the gradients are nan.
+# The gradients with respect to dts are a.f at the end of each step plus the adjoint
+# of the time t, which includes the cotangents of the output times.
+# y is an example of the second argument of f. output is the output policy of
+# forward, see scan_outputs, reductions are not supported.
+# Closed-over arrays of f are made explicit with jax.closure_convert so that
+# gradients with respect to them are computed as well.
+def backsolve(forward,field,update,f,x,chart,cy,inputs,y,output=None,max_chart_updates=default_max_chart_updates):
+    if isinstance(output,tuple):
+        raise ValueError('reductions are not supported with adjoint gradients')
+    cy = tuple([jnp.asarray(y) for y in cy])
+    f, consts = jax.closure_convert(f,(0.,x,chart,*cy),y)
+    return _backsolve(forward,field,update,output,max_chart_updates,f,x,chart,cy,inputs,consts)
+
+@partial(jax.custom_vjp,nondiff_argnums=(0,1,2,3,4,5))
+def _backsolve(forward,field,update,output,max_chart_updates,f,x,chart,cy,inputs,consts):
+    return forward(lambda c,y: f(c,y,*consts),x,chart,cy,inputs,None)
+
+def _backsolve_fwd(forward,field,update,output,max_chart_updates,f,x,chart,cy,inputs,consts):
+    buf = chart_update_buffer((x,*cy),chart,inputs[0],max_chart_updates) if chart is not None else None
+    (xs,buf) = forward(lambda c,y: f(c,y,*consts),x,chart,cy,inputs,buf)
+    xT = xs if output == 'final' else jax.tree_util.tree_map(lambda x: x[-1],xs)
+    return (xs,(xT,chart,inputs,consts,buf))
+
+def _backsolve_bwd(forward,field,update,output,max_chart_updates,f,res,g):
+    ((T,xT,chartT,*cyT),chart,inputs,consts,buf) = res
+    zeros_like = lambda x: jax.tree_util.tree_map(jnp.zeros_like,x)
+    stateT = (xT,*cyT)
+    _,unravel = jax.flatten_util.ravel_pytree((stateT,stateT,T,consts,tuple([y[0] for y in inputs])))
+    ravel = lambda z: jax.flatten_util.ravel_pytree(z)[0]
+    _field = lambda t,state,chart,y,consts: field(lambda c,y: f(c,y,*consts),t,state,chart,y)
+
+    def F(t,z,y,chart):
+        (state,a,_,_,_) = unravel(z)
+        fstate,vjp = jax.vjp(lambda t,state,y,consts: _field(t,state,chart,y,consts),t,state,y,consts)
+        (at,astate,ay,aconsts) = vjp(a)
+        return ravel((fstate,*jax.tree_util.tree_map(lambda x: -x,(astate,at,aconsts,ay))))
+
+    def rk4(t,z,h,y,chart):
+        k1 = F(t,z,y,chart)
+        k2 = F(t+h/2,z+h/2*k1,y,chart)
+        k3 = F(t+h/2,z+h/2*k2,y,chart)
+        k4 = F(t+h,z+h*k3,y,chart)
+        return z+h/6*(k1+2*k2+2*k3+k4)
+
+    # cotangents of the outputs, output j is the state after step (j+1)*k-1 or the final state
+    n = inputs[0].shape[0]
+    k = 1 if output is None else n if output == 'final' else output
+    g = jax.tree_util.tree_map(lambda g: g[None],g) if output == 'final' else g
+    gstate = (g[0],g[1],*g[3:])
+    def cotangent(i):
+        j = jnp.where((i+1) % k == 0,(i+1)//k-1,n//k)
+        valid = ((i+1) % k == 0) | (i == n-1)
+        return jax.tree_util.tree_map(lambda g: jnp.where(valid,g[jnp.minimum(j,g.shape[0]-1)],0.),gstate)
+
+    # chart change p on the current step: integrate back to it and pull a back through the update
+    def chart_change(c):
+        (t,z,chart,r,p,y) = c
+        (m,steps,offsets,states,charts) = buf
+        h = offsets[p]-r
+        (_,a,at,aconsts,ay) = unravel(rk4(t,z,h,y,chart))
+        state = jax.tree_util.tree_map(lambda x: x[p],states)
+        _,vjp = jax.vjp(lambda state: update(t+h,state,charts[p],y)[0],state)
+        return (t+h,ravel((state,*vjp(a),at,aconsts,ay)),charts[p],offsets[p],p-1,y)
+
+    def step(c,y):
+        t,state,chart,a,at,aconsts,p = c
+        y,i = y
+        (gt,*gstate) = cotangent(i)
+        a = jax.tree_util.tree_map(lambda a,g: a+g,a,tuple(gstate)) # cotangent of output at t
+        at = at+gt
+        adt = sum([jnp.vdot(a,f) for (a,f) in zip(a,_field(t,state,chart,y,consts))])+at # extending step i at its end
+        z = ravel((state,a,at,aconsts,zeros_like(y)))
+        r = y[0]
+        if buf is not None:
+            (t,z,chart,r,p,_) = lax.while_loop(lambda c: (c[4] >= 0) & (buf[1][jnp.maximum(c[4],0)] == i),chart_change,(t,z,chart,r,p,y))
+        (state,a,at,aconsts,ay) = unravel(rk4(t,z,-r,y,chart))
+        return ((t-r,state,chart,a,at,aconsts,p),(ay[0]+adt,*ay[1:]))
+
+    p = jnp.minimum(buf[0],buf[1].shape[0])-1 if buf is not None else -1
+    (_,_,_,a,_,aconsts,_),ays = lax.scan(step,(T,stateT,chartT,zeros_like(stateT),zeros_like(T),zeros_like(consts),p),
+                                         (inputs,jnp.arange(n)),reverse=True)
+    grads = (a[0],zeros_like(chart),tuple(a[1:]),ays,aconsts)
+    if buf is not None: # buffer overflow
+        grads = jax.tree_util.tree_map(lambda g: jnp.where(buf[0] > buf[1].shape[0],jnp.nan,g),grads)
+    return grads
+
+_backsolve.defvjp(_backsolve_fwd,_backsolve_bwd)
+
+# return symbolic path given ode and integrator
+# integration options that must be static when jitting functions passing them on to integrate
+integrate_static_argnames = ['method','gradient','checkpoint_segments','checkpoint_policy','output','max_chart_updates','rtol','atol','max_steps']
+
+# jit for functions passing integration options on to integrate: the options in
+# static_argnames are static, except for the initial value of a reduction
+# output=(reduce,init), which is traced. reduce is static and hashed by identity,
+# i.e. define it once rather than as a new lambda in each call to avoid recompilation
+def jit_integrate(f,static_argnames=integrate_static_argnames):
+    def _f(*args,output=None,output_init=None,**kwargs):
+        return f(*args,output=(output,output_init) if callable(output) else output,**kwargs)
+    _f = jit(_f,static_argnames=static_argnames)
+    def jf(*args,output=None,**kwargs):
+        if isinstance(output,tuple):
+            (output,init) = output
+            return _f(*args,output=output,output_init=init,**kwargs)
+        return _f(*args,output=output,**kwargs)
+    return jf
+
+def integrate(ode,chart_update,x,chart,dts,*ys,method=default_method,
+              gradient=default_gradient,checkpoint_segments=default_checkpoint_segments,checkpoint_policy=None,
+              output=None,max_chart_updates=default_max_chart_updates,**kwargs):
+    """ integrate ode. method is either a fixed step integrator ('euler', 'rk4') taking the steps dts,
+    or an adaptive method from adaptive_tableaux, see integrate_adaptive for its arguments.
+    gradient selects how reverse mode derivatives are computed: None stores all steps,
+    'checkpoint' recomputes steps in segments (see scan_checkpoint, fixed step methods only), 
+    'adjoint' solves the adjoint equation backwards (see backsolve), which also makes 
+    the adaptive methods reverse differentiable. Chart changes are recorded for the
+    backward pass, up to max_chart_updates of them.
+    output is the output policy, see scan_outputs: None for the full trajectory,
+    'final' for the endpoint (t,x,chart), k for every k'th step or (reduce,init) for 
+    a reduction of the states (t,x,chart). Through functions jitted with jit_integrate,
+    e.g. M.geodesic, init is traced and reduce must be hashable """
+    if chart_update is None:
+        update = lambda t,state,chart,y: (state,chart)
+    else:
+        update = lambda t,state,chart,y: (lambda x,chart: ((x,),chart))(*chart_update(state[0],chart,y[1:]))
+    if method in adaptive_tableaux:
+        def forward(ode,x,chart,cy,inputs,buf=None):
+            xs = integrate_adaptive(ode,chart_update,x,chart,*inputs,method=method,buf=buf,**kwargs)
+            return select_outputs(xs,output) if buf is None else (select_outputs(xs[0],output),xs[1])
+    else:
+        _gradient = gradient if gradient != 'adjoint' else None
+        def forward(ode,x,chart,cy,inputs,buf=None):
+            if buf is None:
+                return scan_outputs(integrator(ode,chart_update,method),(0.,x,chart),inputs,output,
+                                    gradient=_gradient,checkpoint_segments=checkpoint_segments,checkpoint_policy=checkpoint_policy)
+            (xs,(_,buf)) = scan_outputs(record_chart_updates(integrator(ode,None,method),update),(0.,x,chart),inputs,output,aux=(0,buf))
+            return (xs,buf)
+    if gradient == 'adjoint':
+        field = lambda ode,t,state,chart,y: (ode((t,state[0],chart),y[1:]),)
+        xs = backsolve(forward,field,update,ode,x,chart,(),(dts,*ys),tuple([y[0] for y in ys]),output,max_chart_updates)
+    else:
+        xs = forward(ode,x,chart,(),(dts,*ys))
+    if isinstance(output,tuple):
+        return xs
     return xs if chart_update is not None else xs[0:2]
 
 # sde functions should return (det,sto,Sigma) where
@@ -126,11 +733,54 @@ def integrate(ode,chart_update,x,chart,dts,*ys):
 # and Sigma stochastic generator (i.e. often sto=dot(Sigma,dW)
 
 
-def integrate_sde(sde,integrator,chart_update,x,chart,dts,dWs,*cy):
-    _,xs = lax.scan(integrator(sde,chart_update),
-            (0.,x,chart,*cy),
-            (dts,dWs,))
-    return xs
+def integrate_sde(sde,integrator,chart_update,x,chart,dts,dWs,*cy,
+                  gradient=default_gradient,checkpoint_segments=default_checkpoint_segments,checkpoint_policy=None,
+                  output=None,max_chart_updates=default_max_chart_updates):
+    """ integrate sde with noise increments dWs. dWs is either an array of increments or a
+    noise function dW(i,t,dt) returning the increment of step i on [t,t+dt], e.g. FoldInNoise,
+    in which case the increments are drawn on the fly and never stored.
+    gradient and output are as for integrate. With
+    'adjoint', the backward pass integrates the Stratonovich form of the sde with the
+    increments of each step fixed, the Ito-Stratonovich correction of the Ito integrators
+    (integrator_ito, integrator_milstein, integrator_srk) is computed by JVPs of X """
+    if callable(dWs): # step inputs (dt,i,t), increments evaluated in the step
+        noise = dWs
+        inputs = (dts,jnp.arange(dts.shape[0],dtype=dts.dtype),jnp.cumsum(dts)-dts)
+        dW = lambda y: (y[0],noise(y[1],y[2],y[0]))
+    else:
+        inputs = (dts,dWs)
+        dW = lambda y: y
+    def _integrator(sde,chart_update):
+        step = integrator(sde,chart_update)
+        return lambda c,y: step(c,dW(y))
+
+    if chart_update is None:
+        update = lambda t,state,chart,y: (state,chart)
+    else:
+        update = lambda t,state,chart,y: (lambda x,chart,*cy: ((x,*cy),chart))(*chart_update(state[0],chart,*state[1:]))
+
+    _gradient = gradient if gradient != 'adjoint' else None
+    def forward(sde,x,chart,cy,inputs,buf=None):
+        if buf is None:
+            return scan_outputs(_integrator(sde,chart_update),(0.,x,chart,*cy),inputs,output,
+                                gradient=_gradient,checkpoint_segments=checkpoint_segments,checkpoint_policy=checkpoint_policy)
+        (xs,(_,buf)) = scan_outputs(record_chart_updates(_integrator(sde,None),update),(0.,x,chart,*cy),inputs,output,aux=(0,buf))
+        return (xs,buf)
+    if gradient == 'adjoint':
+        ito = integrator in (integrator_ito,integrator_milstein,integrator_srk)
+        def field(sde,t,state,chart,y):
+            x,*cy = state
+            y = dW(y)
+            dt,_ = y
+            (det,sto,X,*dcy) = sde((t,x,chart,*cy),y)
+            det = det+sto/dt
+            if ito: # Stratonovich drift, det - 1/2 sum_j DX_j X_j
+                dXf = lambda v: jax.jvp(lambda x: sde((t,x,chart,*cy),y)[2],(x,),(v,))[1]
+                DXX = jax.vmap(dXf,X.ndim-1)(X)
+                det = det-.5*jnp.diagonal(DXX,0,0,DXX.ndim-1).sum(-1)
+            return (det,*[jnp.broadcast_to(dc,c.shape) for (c,dc) in zip(cy,dcy)])
+        return backsolve(forward,field,update,sde,x,chart,cy,inputs,dW(tuple([y[0] for y in inputs])),output,max_chart_updates)
+    return forward(sde,x,chart,cy,inputs)
 
 def integrator_stratonovich(sde_f,chart_update=None):
     if chart_update == None: # no chart update
@@ -161,6 +811,52 @@ def integrator_ito(sde_f,chart_update=None):
 
     return euler
 
+# higher strong order Ito schemes. Both assume commutative noise, i.e. that the
+# last axis of X indexes the noise directions and the fields X_j commute
+# (e.g. diagonal or additive noise), in which case they have strong order 1
+def integrator_milstein(sde_f,chart_update=None):
+    """ Milstein scheme, derivatives of the diffusion field X by JVPs """
+    if chart_update == None: # no chart update
+        chart_update = lambda xp,chart,*cy: (xp,chart,*cy)
+
+    def milstein(c,y):
+        t,x,chart,*cy = c
+        dt,dW = y
+
+        (detx, stox, X, *dcy) = sde_f(c,y)
+        Xf = lambda x: sde_f((t,x,chart,*cy),y)[2]
+        dXf = lambda v: jax.jvp(Xf,(x,),(v,))[1]
+        # 1/2 sum_jk (DX_k X_j)(dW_j dW_k - delta_jk dt)
+        DXXdW = jnp.tensordot(dXf(jnp.tensordot(X,dW,(X.ndim-1,0))),dW,(X.ndim-1,0))
+        DXX = jax.vmap(dXf,X.ndim-1)(X)
+        DXXtr = jnp.diagonal(DXX,0,0,DXX.ndim-1).sum(-1)
+        cy_new = tuple([y+dt*dy for (y,dy) in zip(cy,dcy)])
+        return ((t+dt,*chart_update(x + dt*detx + stox + .5*(DXXdW-dt*DXXtr), chart, *cy_new)),)*2
+
+    return milstein
+
+def integrator_srk(sde_f,chart_update=None):
+    """ derivative-free stochastic Runge-Kutta scheme (Platen), Milstein correction
+    from evaluations of X at supporting values x+det*dt+X_j*sqrt(dt) """
+    if chart_update == None: # no chart update
+        chart_update = lambda xp,chart,*cy: (xp,chart,*cy)
+
+    def srk(c,y):
+        t,x,chart,*cy = c
+        dt,dW = y
+
+        (detx, stox, X, *dcy) = sde_f(c,y)
+        sqrtdt = jnp.sqrt(dt)
+        Xs = jax.vmap(lambda Xj: sde_f((t,x+dt*detx+sqrtdt*Xj,chart,*cy),y)[2],X.ndim-1)(X)
+        # 1/(2 sqrt(dt)) sum_jk (X_k(x_j)-X_k(x))(dW_j dW_k - delta_jk dt)
+        dX = Xs-X
+        corr = jnp.tensordot(jnp.tensordot(dX,dW,(X.ndim,0)),dW,(0,0)) \
+               -dt*jnp.diagonal(dX,0,0,dX.ndim-1).sum(-1)
+        cy_new = tuple([y+dt*dy for (y,dy) in zip(cy,dcy)])
+        return ((t+dt,*chart_update(x + dt*detx + stox + corr/(2*sqrtdt), chart, *cy_new)),)*2
+
+    return srk
+
 
 def cross(a, b):
     return jnp.array([
@@ -168,6 +864,250 @@ def cross(a, b):
         a[2]*b[0] - a[0]*b[2],
         a[0]*b[1] - a[1]*b[0]])
 
+# quaternions (w,x,y,z) along the first axis, further axes broadcast
+def qmul(a,b):
+    return jnp.stack((
+        a[0]*b[0]-a[1]*b[1]-a[2]*b[2]-a[3]*b[3],
+        a[0]*b[1]+a[1]*b[0]+a[2]*b[3]-a[3]*b[2],
+        a[0]*b[2]-a[1]*b[3]+a[2]*b[0]+a[3]*b[1],
+        a[0]*b[3]+a[1]*b[2]-a[2]*b[1]+a[3]*b[0]))
+
+def qconj(a):
+    return jnp.concatenate((a[0:1],-a[1:]))
+
+def qrotate(q,x):
+    """ rotation of x in R^3 by the unit quaternion q """
+    t = 2.*cross(q[1:],x)
+    return x+q[0]*t+cross(q[1:],t)
+
+def qtomatrix(q):
+    """ rotation matrix of the unit quaternion q """
+    (w,x,y,z) = q
+    return jnp.array([[1.-2.*(y*y+z*z),2.*(x*y-w*z),2.*(x*z+w*y)],
+                      [2.*(x*y+w*z),1.-2.*(x*x+z*z),2.*(y*z-w*x)],
+                      [2.*(x*z-w*y),2.*(y*z+w*x),1.-2.*(x*x+y*y)]])
+
+def matrixtoq(R):
+    """ unit quaternion with nonnegative real part of the rotation matrix R """
+    # largest of the four squared components for stability
+    d = jnp.array([1.+R[0,0]+R[1,1]+R[2,2],1.+R[0,0]-R[1,1]-R[2,2],1.-R[0,0]+R[1,1]-R[2,2],1.-R[0,0]-R[1,1]+R[2,2]])
+    i = jnp.argmax(d)
+    s = 2.*jnp.sqrt(jnp.max(d))
+    qs = jnp.array([[.25*s,(R[2,1]-R[1,2])/s,(R[0,2]-R[2,0])/s,(R[1,0]-R[0,1])/s],
+                    [(R[2,1]-R[1,2])/s,.25*s,(R[0,1]+R[1,0])/s,(R[0,2]+R[2,0])/s],
+                    [(R[0,2]-R[2,0])/s,(R[0,1]+R[1,0])/s,.25*s,(R[1,2]+R[2,1])/s],
+                    [(R[1,0]-R[0,1])/s,(R[0,2]+R[2,0])/s,(R[1,2]+R[2,1])/s,.25*s]])
+    q = qs[i]
+    return jnp.where(q[0] < 0,-q,q)
+
+# pairwise sums over point sets in tiles
+def tile_sum(f,xs1,xs2,tile):
+    """ out_i = sum_j f(xs1_i,xs2_j) for pytrees xs1, xs2 of per point data (leading axes N1, N2),
+    evaluated on tile x tile blocks by lax.map over row blocks and lax.scan over column blocks.
+    The blocks are rematerialised in reverse mode, so memory is O(tile^2+N1+N2) instead
+    of O(N1 N2) also for gradients and Hessian-vector products """
+    N1 = jax.tree_util.tree_leaves(xs1)[0].shape[0]
+    N2 = jax.tree_util.tree_leaves(xs2)[0].shape[0]
+    t1 = min(tile,N1); n1 = -(-N1//t1)
+    t2 = min(tile,N2); n2 = -(-N2//t2)
+    blocks = lambda xs,n,t: jax.tree_util.tree_map(lambda x: jnp.concatenate((x,jnp.zeros((n*t-x.shape[0],)+x.shape[1:],x.dtype))).reshape((n,t)+x.shape[1:]),xs)
+    xs1 = blocks(xs1,n1,t1)
+    xs2 = blocks(xs2,n2,t2)
+    mask = (jnp.arange(n2*t2) < N2).reshape((n2,t2)) # padded columns
+    out = jax.eval_shape(f,*jax.tree_util.tree_map(lambda x: x[0,0],(xs1,xs2)))
+
+    pairs = lambda a,b,m: jax.vmap(lambda a: jnp.sum(jax.vmap(lambda b,m: jnp.where(m,f(a,b),0.))(b,m),0))(a)
+    pairs = jax.checkpoint(pairs)
+    def row(a):
+        return lax.scan(lambda acc,bm: (acc+pairs(a,*bm),None),jnp.zeros((t1,)+out.shape,out.dtype),(xs2,mask))[0]
+    return lax.map(jax.checkpoint(row),xs1).reshape((n1*t1,)+out.shape)[:N1]
+
+# fast Gauss transform
+# G(t) = sum_j exp(-|t-s_j|^2/2) w_j by Taylor expansions of the sources around the centres of
+# boxes of side box, exp(-|t-s|^2/2) = exp(-|dt|^2/2) exp(-|ds|^2/2) sum_alpha dt^alpha ds^alpha/alpha!,
+# with dt, ds relative to the centre. Boxes are hashed (up to 2^(31//m) boxes per dimension)
+# so only occupied boxes are stored, and each target sums the boxes within the cutoff radius
+@functools.lru_cache
+def fgt_parameters(m,tol,box=None):
+    """ box side, truncation order p and box offsets such that the fast Gauss transform
+    has absolute error at most tol*sum_j |w_j|. If box is None, the box side with the lowest
+    cost per target is chosen. Returns (box,p,offsets,cost) """
+    if box is None:
+        return min([fgt_parameters(m,tol,box) for box in [.5,.75,1.,1.5,2.]],key=lambda x: x[3])
+    R = np.sqrt(2.*np.log(2./tol)) # cutoff radius, exp(-R^2/2) = tol/2
+    k = int(np.ceil(R/box))
+    offsets = np.array([o for o in itertools.product(range(-k,k+1),repeat=m) 
+                        if box*np.sqrt(np.sum(np.maximum(np.abs(o)-1,0)**2)) < R]) # boxes within the cutoff
+    rs = box*np.sqrt(m)/2 # source distance to box centre
+    a = np.linspace(0.,(k+1)*box*np.sqrt(m),1000) # target distance to box centre
+    for p in range(1,64):
+        # Taylor remainder of exp(dt.ds) bounded by (a rs)^p/p! exp(a rs)
+        if np.max(np.exp(-.5*a**2+a*rs)*(a*rs)**p)/scipy.special.factorial(p) < tol/2:
+            break
+    return (box,p,offsets,offsets.shape[0]*scipy.special.comb(p-1+m,m))
+
+def fgt(s,w,t,parameters,batch_size=256):
+    """ sum_j exp(-|t_i-s_j|^2/2) w_j for sources s (N,m), weights w (N,...) and targets t (M,m)
+    with parameters from fgt_parameters """
+    (box,p,offsets,_) = parameters
+    data = fgt_moments(s,w,box,p)
+    G = lax.map(lambda t: fgt_eval(data,t,box,p,offsets),t,batch_size=batch_size)
+    return G.reshape(t.shape[:1]+w.shape[1:])
+
+def _fgt_monomials(x,p,factorial=False):
+    """ x^alpha (or x^alpha/alpha!) for the multi-indices |alpha| < p, x of shape (...,m) """
+    m = x.shape[-1]
+    alphas = np.array([a for a in itertools.product(range(p),repeat=m) if sum(a) < p])
+    # x_i^n (or x_i^n/n!) by cumulative products (no powers, so derivatives at 0 are finite)
+    xs = jnp.repeat(x[...,np.newaxis],p-1,-1)
+    powers = jnp.cumprod(jnp.concatenate((jnp.ones(x.shape+(1,),x.dtype),xs/np.arange(1,p) if factorial else xs),-1),-1)
+    return jnp.prod(jnp.stack([powers[...,i,alphas[:,i]] for i in range(m)],-1),-1)
+
+def _fgt_keys(boxes):
+    m = boxes.shape[-1]
+    bits = 31//m
+    return jnp.sum((jnp.clip(boxes,-2**(bits-1),2**(bits-1)-1)+2**(bits-1))*(2**(bits*np.arange(m))),-1)
+
+def fgt_moments(s,w,box,p):
+    """ box keys and moments of the sources s (N,m) with weights w (N,...) """
+    boxes = lax.stop_gradient(jnp.floor(s/box)).astype(jnp.int32)
+    keys = _fgt_keys(boxes)
+    ukeys = jnp.unique(keys,size=s.shape[0],fill_value=jnp.iinfo(jnp.int32).max)
+    ds = s-(boxes+.5)*box
+    moments = jnp.exp(-.5*jnp.sum(ds**2,-1))[:,np.newaxis]*_fgt_monomials(ds,p,True)
+    moments = jnp.einsum('ja,jc->jac',moments,w.reshape((w.shape[0],-1)))
+    return (ukeys,jax.ops.segment_sum(moments,jnp.searchsorted(ukeys,keys),num_segments=s.shape[0]))
+
+def fgt_eval(data,t,box,p,offsets):
+    """ evaluate the transform with data from fgt_moments at the target t (m,) """
+    (ukeys,moments) = data
+    boxes = lax.stop_gradient(jnp.floor(t/box)).astype(jnp.int32)+offsets
+    keys = _fgt_keys(boxes)
+    idx = jnp.minimum(jnp.searchsorted(ukeys,keys),ukeys.shape[0]-1)
+    dt = t-(boxes+.5)*box
+    c = jnp.where(ukeys[idx] == keys,jnp.exp(-.5*jnp.sum(dt**2,-1)),0.)[:,np.newaxis]*_fgt_monomials(dt,p)
+    return jnp.einsum('ba,bac->c',c,moments[idx])
+
+# matrix-free linear algebra for symmetric positive definite operators A(v)
+def cg(A,b,M=None,tol=default_cg_tol,maxiter=default_cg_maxiter):
+    """ solve A(x)=b by conjugate gradients, M(r) applies a preconditioner (approximate inverse of A) """
+    return jax.scipy.sparse.linalg.cg(A,b,M=M,tol=tol,maxiter=maxiter)[0]
+
+def lbfgs(f,x0,maxiter=default_lbfgs_maxiter,tol=default_lbfgs_tol,history=default_lbfgs_history,max_linesearch=20):
+    """ minimize f from x0 by L-BFGS with backtracking line search, jittable and vmappable over 
+    batches of problems (each stops when |grad f| < tol, the batch when all have stopped).
+    Returns (x, f(x), |grad f(x)|, number of iterations) """
+    value_and_grad = jax.value_and_grad(f)
+    c1 = 1e-4 # Armijo constant
+
+    def direction(g,S,Y,rho,k):
+        # two-loop recursion, the newest pair at index (k-1) % history
+        idx = (k-1-jnp.arange(history)) % history
+        valid = jnp.arange(history) < jnp.minimum(k,history)
+        def first(q,y):
+            (j,v) = y
+            a = jnp.where(v,rho[j]*jnp.dot(S[j],q),0.)
+            return (q-a*Y[j],a)
+        (q,alphas) = lax.scan(first,g,(idx,valid))
+        j = idx[0]
+        yy = jnp.dot(Y[j],Y[j])
+        gamma = jnp.where(k > 0,jnp.dot(S[j],Y[j])/jnp.where(k > 0,yy,1.),1.)
+        def second(r,y):
+            (j,v,a) = y
+            return (r+jnp.where(v,a-rho[j]*jnp.dot(Y[j],r),0.)*S[j],None)
+        (r,_) = lax.scan(second,gamma*q,(idx[::-1],valid[::-1],alphas[::-1]))
+        return -r
+
+    def cond(c):
+        (i,x,fx,g,S,Y,rho,k,done) = c
+        return jnp.logical_and(i < maxiter,jnp.logical_not(done))
+
+    def body(c):
+        (i,x,fx,g,S,Y,rho,k,done) = c
+        d = direction(g,S,Y,rho,k)
+        gd = jnp.dot(g,d)
+        # restart with steepest descent if d is not a descent direction
+        (d,gd) = (jnp.where(gd < 0,d,-g),jnp.where(gd < 0,gd,-jnp.dot(g,g)))
+        def ls_cond(c):
+            (j,t,fx1,g1) = c
+            return jnp.logical_and(j < max_linesearch,jnp.logical_not(fx1 <= fx+c1*t*gd))
+        def ls_body(c):
+            (j,t,_,_) = c
+            (fx1,g1) = value_and_grad(x+.5*t*d)
+            return (j+1,.5*t,fx1,g1)
+        (fx1,g1) = value_and_grad(x+d)
+        (_,t,fx1,g1) = lax.while_loop(ls_cond,ls_body,(0,1.,fx1,g1))
+        accept = fx1 <= fx+c1*t*gd
+        s = t*d
+        y = g1-g
+        sy = jnp.dot(s,y)
+        store = jnp.logical_and(accept,sy > 1e-10*jnp.sqrt(jnp.dot(s,s)*jnp.dot(y,y)))
+        j = k % history
+        S = jnp.where(store,S.at[j].set(s),S)
+        Y = jnp.where(store,Y.at[j].set(y),Y)
+        rho = jnp.where(store,rho.at[j].set(1./jnp.where(store,sy,1.)),rho)
+        # on a failed line search, clear the memory, or stop if it was already cleared
+        (x,fx,g) = (jnp.where(accept,x+s,x),jnp.where(accept,fx1,fx),jnp.where(accept,g1,g))
+        done = jnp.logical_or(jnp.linalg.norm(g) < tol,jnp.logical_and(jnp.logical_not(accept),k == 0))
+        k = jnp.where(accept,k+store,0)
+        return (i+1,x,fx,g,S,Y,rho,k,done)
+
+    (fx0,g0) = value_and_grad(x0)
+    n = x0.shape[0]
+    init = (0,x0,fx0,g0,jnp.zeros((history,n),x0.dtype),jnp.zeros((history,n),x0.dtype),jnp.zeros(history,x0.dtype),0,jnp.linalg.norm(g0) < tol)
+    (i,x,fx,g,_,_,_,_,_) = lax.while_loop(cond,body,init)
+    return (x,fx,jnp.linalg.norm(g),i)
+
+def lanczos(A,v,num_steps):
+    """ num_steps of the Lanczos iteration started at v, returns the tridiagonal matrix """
+    def step(c,_):
+        v_prev,v,beta = c
+        w = A(v)-beta*v_prev
+        alpha = jnp.dot(w,v)
+        w = w-alpha*v
+        beta = jnp.linalg.norm(w)
+        return ((v,jnp.where(beta > 1e-10,w/beta,0.),beta),(alpha,beta))
+    v = v/jnp.linalg.norm(v)
+    _,(alphas,betas) = lax.scan(step,(jnp.zeros_like(v),v,0.),None,length=num_steps)
+    return jnp.diag(alphas)+jnp.diag(betas[:-1],1)+jnp.diag(betas[:-1],-1)
+
+def logdet_slq(A,n,num_probes=default_slq_probes,num_steps=default_slq_steps,_key=None):
+    """ stochastic Lanczos quadrature estimate of log det A, A(v) an n x n operator.
+    The Rademacher probes are drawn from _key (default a fixed key) """
+    _key = jax.random.PRNGKey(seed) if _key is None else _key
+    dtype = jax.eval_shape(A,jax.ShapeDtypeStruct((n,),jnp.zeros(0).dtype)).dtype
+    zs = jax.random.rademacher(_key,(num_probes,n)).astype(dtype)
+    def quadrature(z):
+        (thetas,U) = jnp.linalg.eigh(lanczos(A,z,min(num_steps,n)))
+        return jnp.dot(U[0]**2,jnp.log(jnp.maximum(thetas,1e-30)))
+    return n*jnp.mean(jax.vmap(quadrature)(zs))
+
+# matrix square root and logarithm
+def sqrtm(X,iterations=8):
+    """ principal square root by the product form Denman-Beavers iteration """
+    I = jnp.eye(X.shape[0],dtype=X.dtype)
+    def step(c,_):
+        (M,Y) = c
+        Minv = jnp.linalg.inv(M)
+        return ((.5*I+.25*(M+Minv),.5*jnp.dot(Y,I+Minv)),None)
+    ((_,Y),_) = lax.scan(step,(X,X),None,length=iterations)
+    return Y
+
+def logm(X,max_sqrtm=16,theta=.25,order=8):
+    """ principal logarithm by inverse scaling and squaring: square roots are taken until |X-I| <= theta
+    (at most max_sqrtm), and log(I+A) = int_0^1 A(I+tA)^{-1} dt is evaluated by Gauss-Legendre 
+    quadrature with order nodes (the diagonal Pade approximant) """
+    I = jnp.eye(X.shape[0],dtype=X.dtype)
+    def root(c,_):
+        (X,k) = c
+        need = jnp.linalg.norm(X-I) > theta
+        return ((lax.cond(need,sqrtm,lambda X: X,X),k+need),None)
+    ((X,k),_) = lax.scan(root,(X,0),None,length=max_sqrtm)
+    A = X-I
+    (nodes,weights) = np.polynomial.legendre.leggauss(order)
+    L = sum([.5*w*jnp.linalg.solve(I+.5*(t+1)*A,A) for (t,w) in zip(nodes,weights)])
+    return 2.**k*L
+
 def mmT(A,C=None):
     return A@A.T if C is None else A@C@A.T
         